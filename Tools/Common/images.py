@@ -0,0 +1,19 @@
+import glob
+import os
+
+IMAGE_EXTENSIONS = ('.jpg', '.jpeg', '.png')
+
+
+def find_image(predictions_filename):
+    """
+    Original image of the predictions, the image in the same directory with the shortest name which is a prefix
+    of the predictions filename (1929-right.jpg for 1929-right-yolo-singleclass.txt
+    and 1929-right-roboflow-singleclass-sorted.json), plots of predictions are named after the predictions and are longer.
+    """
+    directory, predictions_name = os.path.split(predictions_filename)
+    candidates = [filename for filename in glob.glob(os.path.join(directory or '.', '*'))
+                  if os.path.splitext(filename)[1].lower() in IMAGE_EXTENSIONS
+                  and predictions_name.startswith(os.path.splitext(os.path.basename(filename))[0])]
+    if not candidates:
+        raise FileNotFoundError(f"no image for {predictions_filename}")
+    return min(candidates, key=lambda filename: len(os.path.splitext(os.path.basename(filename))[0]))
@@ -0,0 +1,203 @@
+import argparse
+import cProfile
+import json
+import os
+import pstats
+import sys
+import time
+import tracemalloc
+from contextlib import contextmanager
+try:
+    import resource
+except ImportError:
+    # not available on Windows, peak RSS is not recorded there
+    resource = None
+
+DETAILS = ['cprofile', 'tracemalloc']
+
+
+def peak_rss_bytes():
+    """
+    Peak resident set size of this process so far, None where it is not available.
+    """
+    if resource is None:
+        return None
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # bytes on macOS, kilobytes elsewhere
+    return peak if sys.platform == 'darwin' else peak * 1024
+
+
+def reset_traced_peak():
+    """
+    Reset the peak of memory traced by tracemalloc, tracing is restarted where tracemalloc.reset_peak
+    is not available (before Python 3.9).
+    :return: Memory traced after the reset.
+    """
+    if hasattr(tracemalloc, 'reset_peak'):
+        tracemalloc.reset_peak()
+    else:
+        tracemalloc.stop()
+        tracemalloc.start()
+    return tracemalloc.get_traced_memory()[0]
+
+
+def hot_functions(profile, top):
+    """
+    :return: List of the top functions of the profile by cumulative time.
+    """
+    stats = pstats.Stats(profile)
+    functions = sorted(stats.stats.items(), key=lambda item: item[1][3], reverse=True)[:top]
+    return [{"function": f"{os.path.basename(filename)}:{line}({name})", "calls": calls, "tottime_s": round(tottime, 6),
+             "cumtime_s": round(cumtime, 6)}
+            for (filename, line, name), (primitive_calls, calls, tottime, cumtime, callers) in functions]
+
+
+def top_allocations(snapshot, top):
+    """
+    :return: List of the source lines which allocated the most memory still allocated at the end of the stage.
+    """
+    return [{"where": f"{os.path.basename(statistic.traceback[0].filename)}:{statistic.traceback[0].lineno}",
+             "bytes": statistic.size, "blocks": statistic.count}
+            for statistic in snapshot.statistics('lineno')[:top]]
+
+
+class Profiler:
+    """
+    Records stages of a tool as JSON lines, one line per stage with wall time, CPU time of this process,
+    peak RSS of this process so far and counts of processed items (polygons, vertices, glyphs...).
+    Without a path nothing is recorded, stages only pass their counts through, so tools use stages unconditionally.
+    With detail "cprofile" the hot functions of every stage are recorded, with "tracemalloc" its allocation peak
+    and the lines allocating the most memory, both slow the stages down.
+    """
+
+    def __init__(self, path=None, tool=None, detail=None, top=15):
+        """
+        :param path: JSON lines file, lines are appended, so more runs (and tools) can share it.
+        :param tool: Name of the tool in every line.
+        """
+        if detail is not None and detail not in DETAILS:
+            raise ValueError(f"unknown profile detail {detail}")
+        self.tool = tool
+        self.detail = detail
+        self.top = top
+        # lines of one run of the tool have the same run id
+        self.run = f"{os.getpid()}-{int(time.time() * 1000)}"
+        self._file = open(path, 'a') if path else None
+
+    @property
+    def enabled(self):
+        return self._file is not None
+
+    @contextmanager
+    def stage(self, name, **counts):
+        """
+        Record one stage, counts can also be added to the yielded dictionary inside the block.
+        """
+        counts = dict(counts)
+        if not self.enabled:
+            yield counts
+            return
+
+        profile = None
+        started_tracing = False
+        if self.detail == 'cprofile':
+            profile = cProfile.Profile()
+        elif self.detail == 'tracemalloc':
+            started_tracing = not tracemalloc.is_tracing()
+            if started_tracing:
+                tracemalloc.start()
+            traced_start = reset_traced_peak()
+        error = None
+        start_time = time.time()
+        wall_start = time.perf_counter()
+        cpu_start = time.process_time()
+        if profile is not None:
+            profile.enable()
+        try:
+            yield counts
+        except BaseException as exception:
+            error = type(exception).__name__
+            raise
+        finally:
+            if profile is not None:
+                profile.disable()
+            record = {"tool": self.tool, "run": self.run, "stage": name, "start": round(start_time, 3),
+                      "wall_s": round(time.perf_counter() - wall_start, 6),
+                      "cpu_s": round(time.process_time() - cpu_start, 6), "peak_rss_bytes": peak_rss_bytes(),
+                      "counts": counts}
+            if error is not None:
+                record["error"] = error
+            if profile is not None:
+                record["hot_functions"] = hot_functions(profile, self.top)
+            if self.detail == 'tracemalloc':
+                record["traced_peak_bytes"] = tracemalloc.get_traced_memory()[1] - traced_start
+                record["top_allocations"] = top_allocations(tracemalloc.take_snapshot(), self.top)
+                if started_tracing:
+                    tracemalloc.stop()
+            self._file.write(json.dumps(record, default=str) + '\n')
+            self._file.flush()
+
+    def close(self):
+        if self._file is not None:
+            self._file.close()
+            self._file = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+
+def add_profile_arguments(parser):
+    parser.add_argument("--profile", metavar="PATH",
+                        help="Append wall time, CPU time, peak RSS and item counts of every stage as JSON lines to this file")
+    parser.add_argument("--profile-detail", choices=DETAILS,
+                        help="With --profile, also record hot functions (cprofile) or allocations (tracemalloc) of every"
+                             " stage, stages run slower")
+
+
+def create_profiler(args, tool):
+    """
+    Profiler configured by the arguments of add_profile_arguments.
+    """
+    return Profiler(args.profile, tool, args.profile_detail)
+
+
+def read_traces(paths):
+    records = []
+    for path in paths:
+        with open(path, 'r') as file:
+            records.extend(json.loads(line) for line in file if line.strip())
+    return records
+
+
+def summarize(records):
+    """
+    Print totals of stages of all runs of every tool and processed items per second of every count.
+    """
+    stages = {}
+    for record in records:
+        stages.setdefault((record["tool"], record["stage"]), []).append(record)
+    print(f"{'tool':18} {'stage':16} {'runs':>5} {'wall [s]':>9} {'cpu [s]':>9} {'mean [ms]':>10} {'max [ms]':>9}"
+          f" {'peak RSS [MB]':>13}  items/s")
+    for (tool, stage), stage_records in stages.items():
+        wall = [record["wall_s"] for record in stage_records]
+        cpu = sum(record["cpu_s"] for record in stage_records)
+        peaks = [record["peak_rss_bytes"] for record in stage_records if record.get("peak_rss_bytes")]
+        counts = {}
+        for record in stage_records:
+            for item, count in record["counts"].items():
+                if isinstance(count, (int, float)):
+                    counts[item] = counts.get(item, 0) + count
+        throughput = ', '.join(f"{count / max(sum(wall), 1e-9):.0f} {item}" for item, count in counts.items())
+        print(f"{str(tool):18} {stage:16} {len(stage_records):5d} {sum(wall):9.3f} {cpu:9.3f}"
+              f" {sum(wall) / len(wall) * 1000:10.1f} {max(wall) * 1000:9.1f}"
+              f" {max(peaks) / 2 ** 20 if peaks else 0:13.1f}  {throughput}")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Summarize profiles of the tools written with --profile.")
+    parser.add_argument("paths", nargs="+", help="JSON lines files written with --profile")
+    args = parser.parse_args()
+    summarize(read_traces(args.paths))
@@ -0,0 +1,79 @@
+import argparse
+import glob
+import os
+import time
+import numpy as np
+from PIL import Image, ImageDraw
+from draw import normalize_glyph, rasterize_glyph
+
+DEFAULT_TEST_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', '..', 'Test')
+
+
+def rasterize_glyph_full_canvas(points, image_width, image_height):
+    # previous implementation: full size RGB canvas for every polygon, scanned by getbbox
+    empty_image = Image.new("RGB", (image_width, image_height), color="#000000")
+    draw = ImageDraw.Draw(empty_image)
+    draw.polygon(points, outline="#FFFFFF", fill="#FFFFFF")
+    bbox = empty_image.getbbox()
+    if bbox is None:
+        return None
+    return empty_image.crop(bbox)
+
+
+def find_inscriptions(test_dir):
+    """
+    Polygon files in YOLO format with the original image of the inscription.
+    :return: List of (polygons filename, image filename).
+    """
+    inscriptions = []
+    for directory in sorted(glob.glob(os.path.join(test_dir, '*'))):
+        name = os.path.basename(directory)
+        images = [filename for filename in glob.glob(os.path.join(directory, name + '.*'))
+                  if os.path.splitext(filename)[1].lower() in ('.jpg', '.png')]
+        if not images:
+            continue
+        for polygons_filename in sorted(glob.glob(os.path.join(directory, name + '-*singleclass*.txt'))):
+            if not polygons_filename.endswith('-classified.txt'):
+                inscriptions.append((polygons_filename, images[0]))
+    return inscriptions
+
+
+def read_points(polygons_filename, image_width, image_height):
+    with open(polygons_filename, 'r') as file:
+        lines = [line.split() for line in file if line.strip()]
+    return [[(float(parts[i]) * image_width, float(parts[i + 1]) * image_height) for i in range(1, len(parts) - 1, 2)]
+            for parts in lines]
+
+
+def benchmark(inscriptions, scale):
+    print(f"{'polygons file':60} {'glyphs':>6} {'full canvas':>20} {'bbox canvas':>20} {'same':>5}")
+    for polygons_filename, image_filename in inscriptions:
+        with Image.open(image_filename) as image:
+            image_width, image_height = int(image.width * scale), int(image.height * scale)
+        polygons = read_points(polygons_filename, image_width, image_height)
+
+        start = time.perf_counter()
+        full_glyphs = [normalize_glyph(rasterize_glyph_full_canvas(points, image_width, image_height))
+                       for points in polygons]
+        full_time = time.perf_counter() - start
+        full_bytes = len(polygons) * image_width * image_height * 3
+
+        start = time.perf_counter()
+        glyphs = [normalize_glyph(rasterize_glyph(points, image_width, image_height)) for points in polygons]
+        bbox_time = time.perf_counter() - start
+        bbox_bytes = sum((np.ptp([x for x, y in points]) + 4) * (np.ptp([y for x, y in points]) + 4)
+                         for points in polygons)
+
+        same = all(np.array_equal(np.asarray(full)[:, :, 0], np.asarray(glyph)) for full, glyph in zip(full_glyphs, glyphs))
+        print(f"{os.path.basename(polygons_filename):60} {len(polygons):6d}"
+              f" {full_time * 1000:9.1f} ms {full_bytes / 2 ** 20:6.0f} MB"
+              f" {bbox_time * 1000:9.1f} ms {bbox_bytes / 2 ** 20:6.2f} MB {str(same):>5}")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Compare full image and bounding box canvas glyph rasterization.")
+    parser.add_argument("-d", "--test-dir", default=DEFAULT_TEST_DIR, help="Directory with test inscriptions")
+    parser.add_argument("-s", "--scale", type=float, default=1.0,
+                        help="Scale of the original image size, e.g. 3 simulates a 3x larger scan")
+    args = parser.parse_args()
+    benchmark(find_inscriptions(args.test_dir), args.scale)
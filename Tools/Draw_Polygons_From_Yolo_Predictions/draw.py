@@ -1,73 +1,432 @@
 import argparse
+import math
+import cv2
 from PIL import Image, ImageDraw
 import os
+import sys
+import time
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from functools import partial
+from itertools import chain
+import numpy as np
+from glyph_archive import GlyphArchiveWriter
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'Common'))
+from profiling import add_profile_arguments, create_profiler
 
-def process_polygons(dataset_path, image_path):
-    # Read all polygons from the dataset
+# Glyphs are resized to GLYPH_SIZE on the longer side and centered on IMAGE_SIZE x IMAGE_SIZE black background
+GLYPH_SIZE = 80
+IMAGE_SIZE = 100
+
+
+def rasterize_mask(points, image_width, image_height):
+    """
+    Draw polygon white on black and crop it tightly.
+    Only the bounding box of the polygon is allocated instead of the whole original image,
+    pixels outside of the original image are cut off the same way.
+    :param points: List of (x, y) polygon points in pixels of the original image.
+    :param image_width: Width of the original image.
+    :param image_height: Height of the original image.
+    :return: Cropped single channel ("L") mask of the polygon and its box (left, top, right, bottom)
+        in the original image, None and None if no pixel is drawn.
+    """
+    x_coords = [point[0] for point in points]
+    y_coords = [point[1] for point in points]
+    # one pixel margin on each side covers rounding of the polygon outline
+    left = max(math.floor(min(x_coords)) - 1, 0)
+    top = max(math.floor(min(y_coords)) - 1, 0)
+    right = min(math.ceil(max(x_coords)) + 2, image_width)
+    bottom = min(math.ceil(max(y_coords)) + 2, image_height)
+    if right <= left or bottom <= top:
+        return None, None
+
+    canvas = Image.new("L", (right - left, bottom - top), color=0)
+    draw = ImageDraw.Draw(canvas)
+    draw.polygon([(x - left, y - top) for x, y in points], outline=255, fill=255)
+    bbox = canvas.getbbox()
+    if bbox is None:
+        return None, None
+    return canvas.crop(bbox), (left + bbox[0], top + bbox[1], left + bbox[2], top + bbox[3])
+
+def rasterize_glyph(points, image_width, image_height):
+    """
+    Cropped single channel ("L") white on black image of the polygon, None if no pixel is drawn.
+    """
+    return rasterize_mask(points, image_width, image_height)[0]
+
+def crop_glyph_pixels(pixels, points):
+    """
+    Cut pixels of the polygon from the decoded original image, pixels outside of the polygon are black.
+    :param pixels: Array of the original image of shape (height, width, 3).
+    :param points: List of (x, y) polygon points in pixels of the original image.
+    :return: Cropped RGB image of the polygon, None if the polygon is empty.
+    """
+    mask, box = rasterize_mask(points, pixels.shape[1], pixels.shape[0])
+    if mask is None:
+        return None
+    left, top, right, bottom = box
+    glyph = pixels[top:bottom, left:right] * (np.asarray(mask)[:, :, np.newaxis] > 0)
+    return Image.fromarray(glyph)
+
+def normalize_glyph(cropped_image):
+    """
+    Resize cropped glyph to GLYPH_SIZE on the longer side and center it on IMAGE_SIZE x IMAGE_SIZE black background.
+    :param cropped_image: Cropped glyph, None for an empty glyph.
+    :return: Image of size IMAGE_SIZE x IMAGE_SIZE in the mode of cropped image.
+    """
+    if cropped_image is None:
+        return Image.new("L", (IMAGE_SIZE, IMAGE_SIZE), color=0)
+
+    # Determine the target size (100xN or Nx100) based on the aspect ratio
+    aspect_ratio = cropped_image.width / cropped_image.height
+    if aspect_ratio >= 1:
+        #target_width = min(100, cropped_image.width)
+        target_width = GLYPH_SIZE
+        target_height = int(target_width / aspect_ratio)
+    else:
+        #target_height = min(100, cropped_image.height)
+        target_height = GLYPH_SIZE
+        target_width = int(target_height * aspect_ratio)
+
+    # Resize the cropped image while maintaining its aspect ratio
+    resized_image = cropped_image.resize((target_width, target_height), Image.LANCZOS)
+
+    # Create a new 100x100 black background
+    new_image = Image.new(cropped_image.mode, (IMAGE_SIZE, IMAGE_SIZE), color=0)
+
+    # Calculate the position to paste the resized image centered in the black background
+    x_offset = (IMAGE_SIZE - target_width) // 2
+    y_offset = (IMAGE_SIZE - target_height) // 2
+
+    # Paste the resized image onto the black background
+    new_image.paste(resized_image, (x_offset, y_offset))
+    return new_image
+
+def read_classified_polygons(dataset_path):
+    """
+    Read polygons from the dataset lazily line by line.
+    :return: Generator of (line index, class, relative coordinates as strings) for lines where the first number is any integer.
+    """
     with open(dataset_path, "r") as f:
-        polygons = f.read().splitlines()
-
-    # Load the original image to get its size
-    original_image = Image.open(image_path)
-    original_width, original_height = original_image.size
-
-    # Process polygons for lines where the first number is any integer
-    for i, polygon in enumerate(polygons):
-        try:
-            class_index = int(polygon.split()[0])
-        except ValueError:
-            # Skip lines where the first part cannot be converted to an integer
-            continue
-
-        # Check if the class index is an integer
-        if isinstance(class_index, int):
-            points_str = polygon.split()[1:]
-            # Scale the relative coordinates back to the original image size
-            points = [(float(points_str[i]) * original_width, float(points_str[i + 1]) * original_height) for i in range(0, len(points_str), 2)]
-
-            # Create an empty image with the size of the original image
-            empty_image = Image.new("RGB", (original_width, original_height), color="#000000")
-
-            # Draw the polygon on the empty image
-            draw = ImageDraw.Draw(empty_image)
-            draw.polygon(points, outline="#FFFFFF", fill="#FFFFFF")
-
-            # Crop the image to fit tightly around the drawn polygon
-            bbox = empty_image.getbbox()
-            cropped_image = empty_image.crop(bbox)
-
-            # Determine the target size (100xN or Nx100) based on the aspect ratio
-            aspect_ratio = cropped_image.width / cropped_image.height
-            if aspect_ratio >= 1:
-                #target_width = min(100, cropped_image.width)
-                target_width = 80
-                target_height = int(target_width / aspect_ratio)
-            else:
-                #target_height = min(100, cropped_image.height)
-                target_height = 80
-                target_width = int(target_height * aspect_ratio)
+        for i, polygon in enumerate(f):
+            parts = polygon.split()
+            if not parts:
+                continue
+            try:
+                class_id = int(parts[0])
+            except ValueError:
+                # Skip lines where the first part cannot be converted to an integer
+                continue
+            yield i, class_id, parts[1:]
+
+def read_polygons(dataset_path):
+    """
+    :return: Generator of (line index, relative coordinates as strings), see read_classified_polygons.
+    """
+    for i, class_id, points_str in read_classified_polygons(dataset_path):
+        yield i, points_str
+
+class SourceImage:
+    """
+    Original image decoded once, all glyph crops are cut from its pixels.
+    With shared=True the pixels are kept in shared memory and worker processes attach to it
+    instead of receiving a copy or decoding the image again, close() releases the memory.
+    Without multiprocessing.shared_memory (Python < 3.8) the pixels are pickled with every task instead.
+    """
+
+    def __init__(self, image_path, draft_scale=None, shared=False):
+        with Image.open(image_path) as original_image:
+            if draft_scale:
+                # JPEG is decoded directly at 1/2, 1/4 or 1/8 of its size, which is much faster than full decode
+                original_image.draft("RGB", (int(original_image.width * draft_scale), int(original_image.height * draft_scale)))
+            pixels = np.asarray(original_image.convert("RGB"))
+        self.shape = pixels.shape
+        self.name = None
+        self._memory = None
+        shared_memory = import_shared_memory() if shared else None
+        if shared_memory is not None:
+            self._memory = shared_memory.SharedMemory(create=True, size=pixels.nbytes)
+            self.name = self._memory.name
+            self._pixels = np.ndarray(self.shape, dtype=np.uint8, buffer=self._memory.buf)
+            self._pixels[:] = pixels
+        else:
+            self._pixels = pixels
+
+    @property
+    def size(self):
+        return self.shape[1], self.shape[0]
+
+    def __getstate__(self):
+        # only the name of the shared memory is sent to worker processes, pixels if there is no shared memory
+        if self.name is None:
+            return {'shape': self.shape, 'name': None, 'pixels': self._pixels}
+        return {'shape': self.shape, 'name': self.name}
 
-            # Resize the cropped image while maintaining its aspect ratio
-            resized_image = cropped_image.resize((target_width, target_height), Image.ANTIALIAS)
+    def __setstate__(self, state):
+        self.shape = state['shape']
+        self.name = state['name']
+        self._memory = None
+        self._pixels = state.get('pixels')
 
-            # Create a new 100x100 black background
-            new_image = Image.new("RGB", (100, 100), color="#000000")
+    def pixels(self):
+        if self._pixels is None:
+            self._pixels = attach_shared_pixels(self.name, self.shape)
+        return self._pixels
 
-            # Calculate the position to paste the resized image centered in the black background
-            x_offset = (100 - target_width) // 2
-            y_offset = (100 - target_height) // 2
+    def close(self):
+        if self._memory is not None:
+            self._pixels = None
+            self._memory.close()
+            self._memory.unlink()
+            self._memory = None
 
-            # Paste the resized image onto the black background
-            new_image.paste(resized_image, (x_offset, y_offset))
+def import_shared_memory():
+    """
+    :return: multiprocessing.shared_memory module, None before Python 3.8.
+    """
+    try:
+        from multiprocessing import shared_memory
+    except ImportError:
+        return None
+    return shared_memory
 
-            # Save the final image
-            polygon_name = f"polygon_{i}.png"
-            new_image.save(polygon_name)
+# shared memory of the source image attached by this worker process, replaced when glyphs of the next image arrive
+_attached_memory = {}
+
+def attach_shared_pixels(name, shape):
+    if name not in _attached_memory:
+        for memory in _attached_memory.values():
+            memory.close()
+        _attached_memory.clear()
+        _attached_memory[name] = import_shared_memory().SharedMemory(name=name)
+    return np.ndarray(shape, dtype=np.uint8, buffer=_attached_memory[name].buf)
+
+def render_glyph(points_str, image_size, source=None):
+    """
+    Rasterize one polygon and normalize it to IMAGE_SIZE x IMAGE_SIZE.
+    :param points_str: Relative coordinates of the polygon as strings.
+    :param image_size: Size (width, height) of the original image.
+    :param source: SourceImage to crop glyph pixels from, white on black mask is drawn if None.
+    :return: Normalized glyph image, "L" for masks, "RGB" for pixels of the source image.
+    """
+    original_width, original_height = image_size
+    # Scale the relative coordinates back to the original image size
+    points = [(float(points_str[i]) * original_width, float(points_str[i + 1]) * original_height) for i in range(0, len(points_str), 2)]
+
+    if source is None:
+        # Draw the polygon into a canvas of the size of its bounding box and crop it
+        cropped_image = rasterize_glyph(points, original_width, original_height)
+    else:
+        cropped_image = crop_glyph_pixels(source.pixels(), points)
+    return normalize_glyph(cropped_image)
+
+def glyph_to_array(glyph_image, size=IMAGE_SIZE):
+    """
+    Grayscale array of the glyph preprocessed the same way predict_polygons.py preprocesses saved PNG files:
+    bilinear resize to size x size and cv2.COLOR_BGR2GRAY conversion of the RGB pixels.
+    :return: uint8 array of shape (size, size).
+    """
+    if glyph_image.size != (size, size):
+        glyph_image = glyph_image.resize((size, size), Image.BILINEAR)
+    pixels = np.asarray(glyph_image)
+    if pixels.ndim == 2:
+        return pixels
+    # pixels are RGB, converted as BGR the same way predict_polygons.py converts PNG files read by cv2
+    return cv2.cvtColor(pixels, cv2.COLOR_BGR2GRAY)
+
+def extract_glyph(index, points_str, image_size, output_dir, source=None):
+    """
+    Rasterize one polygon and save it as polygon_{index}.png to output_dir.
+    :param source: SourceImage to crop glyph pixels from, white on black mask is drawn if None.
+    :return: Path of the saved image.
+    """
+    new_image = render_glyph(points_str, image_size, source)
+
+    # Save the final image, the classifier expects RGB images
+    polygon_name = os.path.join(output_dir, f"polygon_{index}.png")
+    new_image.convert("RGB").save(polygon_name)
+    return polygon_name
+
+def extract_glyph_array(index, points_str, image_size, dump_dir=None, source=None, size=IMAGE_SIZE):
+    """
+    Rasterize one polygon into a grayscale array (see glyph_to_array).
+    :param dump_dir: Also save the glyph as polygon_{index}.png to this directory.
+    :return: Line index of the polygon and uint8 array of shape (size, size).
+    """
+    new_image = render_glyph(points_str, image_size, source)
+    if dump_dir is not None:
+        new_image.convert("RGB").save(os.path.join(dump_dir, f"polygon_{index}.png"))
+    return index, glyph_to_array(new_image, size)
+
+def glyph_tasks(dataset_path, image_path, output_dir=".", source=None):
+    """
+    Arguments of extract_glyph for every polygon of the dataset, polygons are read lazily.
+    """
+    if source is None:
+        # Only the header of the original image is read to get its size
+        with Image.open(image_path) as original_image:
+            image_size = original_image.size
+    else:
+        image_size = source.size
+    yield from polygon_tasks(read_polygons(dataset_path), image_size, output_dir, source)
+
+def polygon_tasks(polygons, image_size, output_dir=".", source=None):
+    """
+    Arguments of extract_glyph for every polygon.
+    :param polygons: Iterable of (index, relative coordinates x1 y1 x2 y2 ... as strings or numbers).
+    """
+    if output_dir is not None:
+        os.makedirs(output_dir, exist_ok=True)
+    for i, points_str in polygons:
+        yield i, points_str, image_size, output_dir, source
+
+def run_glyph_tasks(tasks, executor=None, max_pending=256, function=extract_glyph):
+    """
+    Run function (extract_glyph by default) for every task on the executor (or in this process if None)
+    and keep the order of tasks.
+    At most max_pending tasks are submitted at once, so polygons are read only as fast as they are drawn.
+    :return: Generator of results (paths of saved images) in the order of tasks.
+    """
+    if executor is None:
+        for task in tasks:
+            yield function(*task)
+        return
+
+    pending = deque()
+    for task in tasks:
+        pending.append(executor.submit(function, *task))
+        if len(pending) >= max_pending:
+            yield pending.popleft().result()
+    while pending:
+        yield pending.popleft().result()
+
+def process_polygons(dataset_path, image_path, output_dir=".", executor=None, source_pixels=False, draft_scale=None):
+    """
+    Extract glyphs of one dataset.
+    :param source_pixels: Crop glyph pixels from the original image instead of drawing white on black masks.
+    :param draft_scale: With source_pixels, decode JPEG images at reduced resolution (e.g. 0.5).
+    :return: List of paths of saved images.
+    """
+    if not source_pixels:
+        return list(run_glyph_tasks(glyph_tasks(dataset_path, image_path, output_dir), executor))
+    source = SourceImage(image_path, draft_scale, shared=isinstance(executor, ProcessPoolExecutor))
+    try:
+        return list(run_glyph_tasks(glyph_tasks(dataset_path, image_path, output_dir, source), executor))
+    finally:
+        source.close()
+
+def extract_glyph_arrays(dataset_path, image_path, size=IMAGE_SIZE, executor=None, dump_dir=None,
+                         source_pixels=False, draft_scale=None):
+    """
+    Extract glyphs of one dataset into one contiguous array, which can be passed to the classifier
+    without saving and decoding PNG files.
+    :param size: Side of glyphs in the array, the input size of the classifier.
+    :param dump_dir: Also save glyphs as polygon_{index}.png to this directory.
+    :param source_pixels: Crop glyph pixels from the original image instead of drawing white on black masks.
+    :param draft_scale: With source_pixels, decode JPEG images at reduced resolution (e.g. 0.5).
+    :return: List of line indices of polygons and uint8 array of shape (N, size, size).
+    """
+    return polygon_glyph_arrays(read_polygons(dataset_path), image_path, size, executor, dump_dir, source_pixels, draft_scale)
+
+def polygon_glyph_arrays(polygons, image, size=IMAGE_SIZE, executor=None, dump_dir=None, source_pixels=False,
+                         draft_scale=None):
+    """
+    Extract glyphs of polygons already in memory into one contiguous array (see extract_glyph_arrays).
+    :param polygons: Iterable of (index, relative coordinates x1 y1 x2 y2 ... as strings or numbers).
+    :param image: Path or file object of the original image, masks can also be drawn with only its size (width, height).
+    :return: List of indices of polygons and uint8 array of shape (N, size, size).
+    """
+    source = None
+    if source_pixels:
+        source = SourceImage(image, draft_scale, shared=isinstance(executor, ProcessPoolExecutor))
+        image_size = source.size
+    elif isinstance(image, tuple):
+        image_size = image
+    else:
+        # Only the header of the original image is read to get its size
+        with Image.open(image) as original_image:
+            image_size = original_image.size
+    try:
+        tasks = polygon_tasks(polygons, image_size, dump_dir, source)
+        results = list(run_glyph_tasks(tasks, executor, function=partial(extract_glyph_array, size=size)))
+    finally:
+        if source is not None:
+            source.close()
+    glyphs = np.zeros((len(results), size, size), dtype=np.uint8)
+    for position, (index, glyph) in enumerate(results):
+        glyphs[position] = glyph
+    return [index for index, glyph in results], glyphs
+
+def write_glyph_archive(pairs, archive_path, executor=None, source_pixels=False, draft_scale=None):
+    """
+    Extract glyphs of all datasets into one glyph archive (see glyph_archive.py) instead of PNG files,
+    the id of every inscription is the name of its dataset file.
+    :param pairs: List of (dataset path, image path).
+    :return: Number of saved glyphs.
+    """
+    # polygons are counted first, so glyphs are written straight into the memory-mapped array
+    polygons = [[(i, class_id) for i, class_id, points_str in read_classified_polygons(dataset_path)]
+                for dataset_path, image_path in pairs]
+    with GlyphArchiveWriter(archive_path, sum(len(dataset_polygons) for dataset_polygons in polygons), IMAGE_SIZE) as writer:
+        for (dataset_path, image_path), dataset_polygons in zip(pairs, polygons):
+            indices, glyphs = extract_glyph_arrays(dataset_path, image_path, IMAGE_SIZE, executor,
+                                                   source_pixels=source_pixels, draft_scale=draft_scale)
+            writer.add(os.path.splitext(os.path.basename(dataset_path))[0], dataset_polygons, glyphs)
+    return writer.count
+
+def create_executor(workers, threads=False):
+    if workers == 1:
+        return None
+    if threads:
+        return ThreadPoolExecutor(max_workers=workers)
+    return ProcessPoolExecutor(max_workers=workers)
 
 if __name__ == "__main__":
     parser = argparse.ArgumentParser(description="Process polygons from a dataset.")
-    parser.add_argument("dataset_path", help="Path to the dataset file")
-    parser.add_argument("image_path", help="Path to the original image file")
+    parser.add_argument("paths", nargs="+", metavar="dataset_path image_path",
+                        help="Path to the dataset file and path to the original image file, more pairs can be given")
+    parser.add_argument("-o", "--output-dir", default=".",
+                        help="Output directory, with more pairs every dataset gets its own subdirectory <dataset>-polygons")
+    parser.add_argument("-w", "--workers", type=int, default=os.cpu_count(), help="Number of workers (default number of CPUs)")
+    parser.add_argument("--threads", action="store_true", help="Use threads instead of processes")
+    parser.add_argument("--pixels", action="store_true",
+                        help="Crop glyph pixels from the original image instead of drawing white on black masks")
+    parser.add_argument("--draft-scale", type=float,
+                        help="With --pixels, decode JPEG images at reduced resolution, e.g. 0.5 or 0.25")
+    parser.add_argument("-a", "--archive",
+                        help="Save glyphs of all datasets in one glyph archive <archive>.npy with index <archive>.csv"
+                             " instead of PNG files")
+    add_profile_arguments(parser)
     args = parser.parse_args()
+    if len(args.paths) % 2:
+        parser.error("paths must be pairs of dataset_path and image_path")
 
-    process_polygons(args.dataset_path, args.image_path)
+    pairs = list(zip(args.paths[0::2], args.paths[1::2]))
+    if len(pairs) == 1:
+        output_dirs = [args.output_dir]
+    else:
+        output_dirs = [os.path.join(args.output_dir, os.path.splitext(os.path.basename(dataset_path))[0] + "-polygons")
+                       for dataset_path, image_path in pairs]
+
+    start = time.perf_counter()
+    executor = create_executor(args.workers, args.threads)
+    profiler = create_profiler(args, 'draw')
+    try:
+        # CPU time of worker processes is not included in the profile
+        with profiler.stage('extract', datasets=len(pairs)) as counts:
+            if args.archive:
+                glyphs = write_glyph_archive(pairs, args.archive, executor, args.pixels, args.draft_scale)
+            elif args.pixels:
+                # every source image is decoded only while its glyphs are extracted
+                glyphs = sum(len(process_polygons(dataset_path, image_path, output_dir, executor, True, args.draft_scale))
+                             for (dataset_path, image_path), output_dir in zip(pairs, output_dirs))
+            else:
+                tasks = chain.from_iterable(glyph_tasks(dataset_path, image_path, output_dir)
+                                            for (dataset_path, image_path), output_dir in zip(pairs, output_dirs))
+                glyphs = sum(1 for polygon_name in run_glyph_tasks(tasks, executor))
+            counts["glyphs"] = glyphs
+    finally:
+        if executor is not None:
+            executor.shutdown()
+        profiler.close()
+    print(f"Saved {glyphs} glyphs of {len(pairs)} datasets in {time.perf_counter() - start:.2f} s")
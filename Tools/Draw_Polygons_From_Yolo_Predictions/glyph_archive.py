@@ -0,0 +1,99 @@
+import csv
+import os
+import numpy as np
+
+# Glyph archive: <archive>.npy holds all glyphs as one uint8 array (N, 100, 100), which is memory-mapped when read,
+# <archive>.csv holds one row per glyph: inscription id, order of the glyph in the inscription,
+# class of the source polygon and line index of the source polygon in the dataset.
+# Glyphs of one inscription are stored next to each other in their order.
+INDEX_COLUMNS = ['inscription', 'glyph', 'class', 'polygon']
+
+
+def archive_paths(path):
+    """
+    :param path: Path of the archive with or without the .npy extension.
+    :return: Paths of the glyph array and of the index.
+    """
+    base_path = path[:-len('.npy')] if path.endswith('.npy') else path
+    return base_path + '.npy', base_path + '.csv'
+
+
+class GlyphArchiveWriter:
+    """
+    Writes glyphs straight into the memory-mapped array, the number of glyphs must be known in advance.
+    """
+
+    def __init__(self, path, count, size):
+        self.glyphs_path, self.index_path = archive_paths(path)
+        directory = os.path.dirname(self.glyphs_path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        self.glyphs = np.lib.format.open_memmap(self.glyphs_path, mode='w+', dtype=np.uint8, shape=(count, size, size))
+        self.index_file = open(self.index_path, 'w', newline='')
+        self.index = csv.writer(self.index_file)
+        self.index.writerow(INDEX_COLUMNS)
+        self.count = 0
+
+    def add(self, inscription, polygons, glyphs):
+        """
+        Append glyphs of one inscription.
+        :param inscription: Id of the inscription.
+        :param polygons: List of (line index, class) of source polygons of glyphs.
+        :param glyphs: uint8 array of shape (len(polygons), size, size).
+        """
+        self.glyphs[self.count:self.count + len(glyphs)] = glyphs
+        self.index.writerows((inscription, order, class_id, polygon) for order, (polygon, class_id) in enumerate(polygons))
+        self.count += len(glyphs)
+
+    def close(self):
+        if self.count != len(self.glyphs):
+            raise ValueError(f"archive has room for {len(self.glyphs)} glyphs, {self.count} were written")
+        self.glyphs.flush()
+        del self.glyphs
+        self.index_file.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        if exc_type is None:
+            self.close()
+        else:
+            self.index_file.close()
+
+
+class GlyphArchive:
+    """
+    Glyph archive opened for reading, glyphs are memory-mapped and slices of them are views, nothing is copied
+    until the pixels are used.
+    """
+
+    def __init__(self, path):
+        glyphs_path, index_path = archive_paths(path)
+        self.glyphs = np.load(glyphs_path, mmap_mode='r')
+        with open(index_path, 'r', newline='') as index_file:
+            rows = list(csv.DictReader(index_file))
+        if len(rows) != len(self.glyphs):
+            raise ValueError(f"index of {path} has {len(rows)} rows for {len(self.glyphs)} glyphs")
+        self.inscription_ids = [row['inscription'] for row in rows]
+        self.glyph_order = np.array([int(row['glyph']) for row in rows], dtype=np.int64)
+        self.class_ids = np.array([int(row['class']) for row in rows], dtype=np.int64)
+        self.polygons = np.array([int(row['polygon']) for row in rows], dtype=np.int64)
+        # range of rows of every inscription
+        self.ranges = {}
+        for position, inscription in enumerate(self.inscription_ids):
+            start, end = self.ranges.get(inscription, (position, position))
+            self.ranges[inscription] = (start, position + 1)
+
+    def __len__(self):
+        return len(self.glyphs)
+
+    def inscriptions(self):
+        return list(self.ranges)
+
+    def inscription(self, inscription):
+        """
+        :return: View of glyphs of the inscription of shape (n, size, size) and line indices of their source polygons.
+        """
+        start, end = self.ranges[inscription]
+        return self.glyphs[start:end], self.polygons[start:end]
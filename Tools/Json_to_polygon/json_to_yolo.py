@@ -1,6 +1,14 @@
 import json
 import argparse
+import glob
+import os
+import sys
+from concurrent.futures import ProcessPoolExecutor
+import numpy as np
 from PIL import Image
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'Common'))
+from images import find_image
+from profiling import Profiler, add_profile_arguments, create_profiler
 
 def convert_to_relative_coordinates(points, image_width, image_height):
     # Convert points to relative coordinates with 6 decimals
@@ -8,43 +16,264 @@ def convert_to_relative_coordinates(points, image_width, image_height):
     return relative_points
 
 def get_image_size(image_path):
+    # Only the header of the image is read, pixels are not decoded
     with Image.open(image_path) as img:
         return img.size  # returns (width, height)
 
+def iter_predictions(json_file, chunk_size=1 << 16):
+    """
+    Read predictions of Roboflow JSON one by one, only one prediction and one chunk of the file are in memory.
+    Other values of the top-level object are parsed and skipped, "predictions" keys nested in them are ignored.
+    :param json_file: Opened text file with JSON data {"predictions": [...], ...}.
+    :return: Generator of predictions (dictionaries).
+    """
+    decoder = json.JSONDecoder()
+    buffer = ''
+    position = 0
+    eof = False
+
+    def read_more():
+        nonlocal buffer, position, eof
+        chunk = json_file.read(chunk_size)
+        eof = not chunk
+        # parsed part of the buffer is dropped
+        buffer = buffer[position:] + chunk
+        position = 0
+
+    def next_token():
+        # next character which is not whitespace, None at the end of data
+        nonlocal position
+        while True:
+            while position < len(buffer) and buffer[position].isspace():
+                position += 1
+            if position < len(buffer):
+                return buffer[position]
+            if eof:
+                return None
+            read_more()
+
+    def expect(characters, description):
+        nonlocal position
+        token = next_token()
+        if token is None:
+            raise ValueError(f"unexpected end of JSON data, {description} expected")
+        if token not in characters:
+            raise ValueError(f"{description} expected, found {token!r}")
+        position += 1
+        return token
+
+    def next_value():
+        nonlocal position
+        while True:
+            if next_token() is None:
+                raise ValueError("unexpected end of JSON data, value expected")
+            try:
+                value, end = decoder.raw_decode(buffer, position)
+            except json.JSONDecodeError:
+                # value continues in the next chunk
+                if eof:
+                    raise
+                read_more()
+                continue
+            # a number at the end of the buffer may continue in the next chunk
+            if end == len(buffer) and not eof:
+                read_more()
+                continue
+            position = end
+            return value
+
+    # skip values of the top-level object up to the array of predictions
+    expect('{', "JSON object")
+    if next_token() == '}':
+        return
+    while True:
+        key = next_value()
+        if not isinstance(key, str):
+            raise ValueError(f"object key expected, found {key!r}")
+        expect(':', "':'")
+        if key == "predictions":
+            break
+        next_value()
+        if expect(',}', "',' or '}'") == '}':
+            return
+    if next_token() != '[':
+        raise ValueError(f"predictions must be an array, found {next_token()!r}")
+    position += 1
+
+    while True:
+        while position < len(buffer) and (buffer[position].isspace() or buffer[position] == ','):
+            position += 1
+        if position == len(buffer):
+            if eof:
+                raise ValueError("unexpected end of JSON data in predictions")
+            read_more()
+            continue
+        if buffer[position] == ']':
+            return
+        try:
+            prediction, end = decoder.raw_decode(buffer, position)
+        except json.JSONDecodeError:
+            # prediction continues in the next chunk
+            if eof:
+                raise
+            read_more()
+            continue
+        position = end
+        yield prediction
+
+def normalize_points(coordinates, image_width, image_height):
+    """
+    Relative coordinates of points of many polygons at once.
+    :param coordinates: Flat sequence x1 y1 x2 y2 ... in pixels.
+    :return: float64 array of relative coordinates, unrounded.
+    """
+    coordinates = np.asarray(coordinates, dtype=np.float64).reshape(-1, 2)
+    return (coordinates / np.array([image_width, image_height], dtype=np.float64)).ravel()
+
+# line templates "class_id x1 y1 ..." by number of points
+_line_templates = {}
+
+def format_yolo_lines(class_ids, point_counts, relative_coordinates):
+    """
+    YOLO lines of many polygons formatted by one string operation.
+    Coordinates are written with 6 decimals rounded the same way as round(value, 6) does.
+    :param class_ids: Class of every polygon.
+    :param point_counts: Number of points of every polygon.
+    :param relative_coordinates: Flat sequence of relative coordinates of all polygons.
+    :return: Text with one line per polygon.
+    """
+    templates = []
+    for point_count in point_counts:
+        if point_count not in _line_templates:
+            _line_templates[point_count] = '%s' + ' %.6f' * (2 * point_count) + '\n'
+        templates.append(_line_templates[point_count])
+    values = []
+    start = 0
+    coordinates = relative_coordinates.tolist() if hasattr(relative_coordinates, 'tolist') else list(relative_coordinates)
+    for class_id, point_count in zip(class_ids, point_counts):
+        values.append(class_id)
+        values.extend(coordinates[start:start + 2 * point_count])
+        start += 2 * point_count
+    return ''.join(templates) % tuple(values)
+
+def write_yolo_predictions(predictions, image_width, image_height, output_file, batch_size=1024):
+    """
+    Normalize and write predictions in batches.
+    :param predictions: Iterable of Roboflow predictions.
+    :param output_file: Opened text file.
+    :return: Number of written polygons.
+    """
+    written = 0
+    class_ids, point_counts, coordinates = [], [], []
+
+    def flush():
+        output_file.write(format_yolo_lines(class_ids, point_counts, normalize_points(coordinates, image_width, image_height)))
+        class_ids.clear()
+        point_counts.clear()
+        coordinates.clear()
+
+    for prediction in predictions:
+        points = prediction["points"]
+        class_ids.append(prediction["class_id"])
+        point_counts.append(len(points))
+        for point in points:
+            coordinates.append(point["x"])
+            coordinates.append(point["y"])
+        written += 1
+        if len(class_ids) >= batch_size:
+            flush()
+    if class_ids:
+        flush()
+    return written
+
 def save_yolo_format(json_data, image_width, image_height, output_filename):
-    predictions = json_data["predictions"]
+    # Instance segmentation format: class_id x1 y1 x2 y2 x3 y3 ...
     with open(output_filename, 'w') as output_file:
-        for prediction in predictions:
-            class_id = prediction["class_id"]
-            points = prediction["points"]
+        write_yolo_predictions(json_data["predictions"], image_width, image_height, output_file)
 
-            # Convert points to relative coordinates
-            relative_points = convert_to_relative_coordinates(points, image_width, image_height)
+def generate_output_filename(json_path):
+    json_name = json_path.split('/')[-1].split('.')[0]
+    return f"{json_name}-yolo-formatted.txt"
+
+def convert_file(json_path, image_path, output_filename, profiler=None):
+    """
+    Convert one Roboflow JSON file to YOLO format, the JSON is parsed while it is converted.
+    :param profiler: Profiler recording stages of the conversion (see Common/profiling.py).
+    :return: Output filename and number of polygons.
+    """
+    if profiler is None:
+        profiler = Profiler()
+    # Get image size
+    with profiler.stage('image size'):
+        image_width, image_height = get_image_size(image_path)
+    with profiler.stage('convert') as counts:
+        with open(json_path, "r") as json_file, open(output_filename, 'w') as output_file:
+            polygons = write_yolo_predictions(iter_predictions(json_file), image_width, image_height, output_file)
+        counts["polygons"] = polygons
+    return output_filename, polygons
 
-            # Instance segmentation format: class_id x1 y1 x2 y2 x3 y3 ...
-            instance_segmentation = f"{class_id} {' '.join([f'{point[0]:.6f} {point[1]:.6f}' for point in relative_points])}"
-            output_file.write(instance_segmentation + '\n')
+def convert_batch_file(json_path):
+    """
+    Convert one file of a batch in a worker process.
+    :return: Tuple (output filename, polygons, error), errors are returned, so one broken file does not stop the batch.
+    """
+    try:
+        output_filename = os.path.join(os.path.dirname(json_path), generate_output_filename(json_path))
+        return convert_file(json_path, find_image(json_path), output_filename) + (None,)
+    except Exception as error:
+        return None, 0, f"{type(error).__name__}: {error}"
+
+def convert_batch(path, workers=None, profiler=None):
+    """
+    Convert all JSON files in a directory (or matching a glob pattern), outputs are saved next to them.
+    Files which fail are reported and the batch goes on.
+    :param profiler: Profiler recording the whole batch as one stage (see Common/profiling.py).
+    :return: Number of failed files.
+    """
+    if profiler is None:
+        profiler = Profiler()
+    if os.path.isdir(path):
+        path = os.path.join(path, '*.json')
+    json_paths = sorted(glob.glob(path))
+    failed = 0
+    with profiler.stage('batch', files=len(json_paths), polygons=0) as counts:
+        with ProcessPoolExecutor(max_workers=workers) as executor:
+            futures = [executor.submit(convert_batch_file, json_path) for json_path in json_paths]
+            for json_path, future in zip(json_paths, futures):
+                output_filename, polygons, error = future.result()
+                if error:
+                    failed += 1
+                    print(f"{json_path}: FAILED {error}")
+                    continue
+                counts["polygons"] += polygons
+                print(f"{json_path}: {polygons} polygons saved to {output_filename}")
+        counts["failed"] = failed
+    print(f"Converted {len(json_paths) - failed} files ({counts['polygons']} polygons), {failed} failed.")
+    return failed
 
 def main():
     parser = argparse.ArgumentParser(description="Save instance segmentation data in the specified format to a file.")
     parser.add_argument("--json_data", "-j", type=str, help="Path to the JSON data file")
     parser.add_argument("--image_path", "-i", type=str, help="Path to the image file")
+    parser.add_argument("--batch", "-b", type=str,
+                        help="Directory or glob of JSON files, images are found next to them and outputs are saved next to them")
+    parser.add_argument("--workers", "-w", type=int, help="Number of worker processes in batch mode (default number of CPUs)")
+    add_profile_arguments(parser)
 
     args = parser.parse_args()
-
-    # Load JSON data
-    with open(args.json_data, "r") as json_file:
-        json_data = json.load(json_file)
-
-    # Get image size
-    image_width, image_height = get_image_size(args.image_path)
+    if args.batch:
+        with create_profiler(args, 'json_to_yolo') as profiler:
+            convert_batch(args.batch, args.workers, profiler)
+        return
+    if not args.json_data or not args.image_path:
+        parser.error("--json_data and --image_path are required without --batch")
 
     # Prepare output file name
-    json_name = args.json_data.split('/')[-1].split('.')[0]
-    output_file_name = f"{json_name}-yolo-formatted.txt"
+    output_file_name = generate_output_filename(args.json_data)
 
     # Save YOLO format to a file
-    save_yolo_format(json_data, image_width, image_height, output_file_name)
+    with create_profiler(args, 'json_to_yolo') as profiler:
+        convert_file(args.json_data, args.image_path, output_file_name, profiler)
 
     print(f"YOLO format saved to: {output_file_name}")
 
@@ -0,0 +1,213 @@
+import argparse
+import glob
+import json
+import os
+import time
+import tracemalloc
+import numpy as np
+from pipeline import (DEFAULT_ARCHITECTURE, DEFAULT_CLASSES, DEFAULT_WEIGHTS, apply_order, create_classifier, extract_glyphs,
+                      load_polygons, read_image_size, relative_polygons, sort_order)
+from polygon_store import PolygonStore
+from profiling import peak_rss_bytes, reset_traced_peak
+from row_clustering import SORT_STRATEGIES
+from images import find_image
+from glyph_classifier import glyph_sort_key, read_classified
+
+DEFAULT_TEST_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', '..', 'Test')
+STAGES = ['parse', 'sort', 'extract', 'classify']
+
+
+def find_inscriptions(test_dir):
+    """
+    Unsorted predictions of the Test inscriptions with their image and reference outputs.
+    :return: List of dictionaries with name, polygons and image filename, sorted and classified reference filename
+        (None if there is no reference).
+    """
+    inscriptions = []
+    for polygons_filename in sorted(glob.glob(os.path.join(test_dir, '*', '*-singleclass.txt'))
+                                    + glob.glob(os.path.join(test_dir, '*', '*-singleclass.json'))):
+        base_filename, ext = os.path.splitext(polygons_filename)
+        sorted_filenames = glob.glob(base_filename + '[-_]sorted' + ext)
+        classified_filename = base_filename + '-polygons-classified.txt'
+        inscriptions.append({"name": os.path.basename(polygons_filename), "polygons": polygons_filename,
+                             "image": find_image(polygons_filename),
+                             "sorted": sorted_filenames[0] if sorted_filenames else None,
+                             "classified": classified_filename if os.path.exists(classified_filename) else None})
+    return inscriptions
+
+
+def tile_inscription(polygons, polygons_format, image_size, count):
+    """
+    Synthetic large inscription made of count copies of the inscription stacked below each other,
+    as if the image was count times higher.
+    :return: Predictions text in the format of the inscription and size of the tiled image.
+    """
+    width, height = image_size
+    vertices = np.tile(polygons.vertices.astype(np.float64), (count, 1))
+    shifts = np.repeat(np.arange(count, dtype=np.float64), len(polygons.vertices))
+    if polygons_format == 'yolo':
+        # relative coordinates of the higher image
+        vertices[:, 1] = (vertices[:, 1] + shifts) / count
+    else:
+        vertices[:, 1] += shifts * height
+    offsets = np.concatenate([[0], np.tile(polygons.vertex_counts, count).cumsum()])
+    tiled = PolygonStore(vertices, offsets, np.tile(polygons.class_ids, count))
+    if polygons_format == 'yolo':
+        text = ''.join(tiled.to_yolo_lines())
+    else:
+        text = json.dumps(tiled.to_roboflow_json())
+    return text, (width, height * count)
+
+
+def run_stages(classifier, text, image, strategy, timings, memory=None):
+    """
+    Run all stages of the pipeline on one inscription.
+    :param image: Path of the original image or size (width, height) of a synthetic image.
+    :param timings: Dictionary, seconds spent in every stage are stored in it.
+    :param memory: Dictionary, peak of memory allocated in every stage is stored in it (tracemalloc must be running).
+    :return: Sorted polygons in coordinates of the format and list of predicted class names.
+    """
+    def begin():
+        if memory is not None:
+            return reset_traced_peak(), time.perf_counter()
+        return 0, time.perf_counter()
+
+    def end(stage, started):
+        allocated, start = started
+        timings[stage] = time.perf_counter() - start
+        if memory is not None:
+            memory[stage] = tracemalloc.get_traced_memory()[1] - allocated
+
+    started = begin()
+    polygons, polygons_format = load_polygons(text)
+    image_size = image if isinstance(image, tuple) else read_image_size(image)
+    end('parse', started)
+
+    started = begin()
+    sorted_polygons, rows = apply_order(polygons, *sort_order(polygons, strategy))
+    end('sort', started)
+
+    started = begin()
+    relative = relative_polygons(sorted_polygons, polygons_format, image_size)
+    glyphs = extract_glyphs(relative, image, classifier.imsize)
+    end('extract', started)
+
+    started = begin()
+    predictions = classifier.class_predictions(classifier.predict_batch_probabilities(glyphs))
+    end('classify', started)
+    return sorted_polygons, [class_name for class_name, certainty in predictions]
+
+
+def sorted_text(sorted_polygons, polygons_format):
+    # the same text as sort.py and sort_json.py write
+    if polygons_format == 'roboflow':
+        return json.dumps(sorted_polygons.to_roboflow_json(), indent=4)
+    return ''.join(sorted_polygons.to_yolo_lines())
+
+
+def check_references(inscription, sorted_polygons, polygons_format, classes, check_classified):
+    """
+    Compare outputs with the reference files, line endings of the references are ignored.
+    :return: Status of sorted and classified output: "ok", "DIFF" (with number of differing glyphs) or "-" without reference.
+    """
+    sorted_status = '-'
+    if inscription["sorted"]:
+        with open(inscription["sorted"], 'r') as file:
+            sorted_status = 'ok' if file.read() == sorted_text(sorted_polygons, polygons_format) else 'DIFF'
+    classified_status = '-'
+    if check_classified and inscription["classified"]:
+        reference_classes = read_classified(inscription["classified"])
+        reference = [reference_classes[glyph_name] for glyph_name in sorted(reference_classes, key=glyph_sort_key)]
+        differences = sum(class_name != reference_name for class_name, reference_name in zip(classes, reference))
+        differences += abs(len(classes) - len(reference))
+        classified_status = 'ok' if differences == 0 else f'DIFF {differences}'
+    return sorted_status, classified_status
+
+
+def benchmark(classifier, inscriptions, tiles, repeats, strategy, check_classified, results_file=None):
+    """
+    Time every stage on every inscription tiled to every size, the best of repeats is reported.
+    :return: Number of inscriptions whose outputs differ from the references.
+    """
+    print(f"{'inscription':42} {'tile':>4} {'glyphs':>6} " + ' '.join(f"{stage:>9}" for stage in STAGES)
+          + f" {'glyphs/s':>9} {'peak MB':>8} {'sorted':>6} {'classified':>10}")
+    failed = 0
+    for inscription in inscriptions:
+        with open(inscription["polygons"], 'r') as file:
+            text = file.read()
+        polygons, polygons_format = load_polygons(text)
+        image_size = read_image_size(inscription["image"])
+        for tile in tiles:
+            if tile == 1:
+                tile_text, image = text, inscription["image"]
+            else:
+                tile_text, image = tile_inscription(polygons, polygons_format, image_size, tile)
+
+            best = {}
+            for _ in range(repeats):
+                timings = {}
+                sorted_polygons, classes = run_stages(classifier, tile_text, image, strategy, timings)
+                best = {stage: min(best.get(stage, seconds), seconds) for stage, seconds in timings.items()}
+            # allocations are traced in a separate run, tracing slows the stages down
+            memory = {}
+            tracemalloc.start()
+            try:
+                run_stages(classifier, tile_text, image, strategy, {}, memory)
+            finally:
+                tracemalloc.stop()
+
+            sorted_status, classified_status = '-', '-'
+            if tile == 1:
+                sorted_status, classified_status = check_references(inscription, sorted_polygons, polygons_format, classes,
+                                                                    check_classified)
+                if sorted_status == 'DIFF' or classified_status.startswith('DIFF'):
+                    failed += 1
+            total = sum(best.values())
+            print(f"{inscription['name']:42} {tile:4d} {len(classes):6d} "
+                  + ' '.join(f"{best[stage] * 1000:9.1f}" for stage in STAGES)
+                  + f" {len(classes) / max(total, 1e-9):9.0f} {max(memory.values()) / 2 ** 20:8.2f}"
+                  + f" {sorted_status:>6} {classified_status:>10}")
+            if results_file is not None:
+                results_file.write(json.dumps({"inscription": inscription["name"], "tile": tile, "glyphs": len(classes),
+                                               "seconds": best, "peak_bytes": memory, "sorted": sorted_status,
+                                               "classified": classified_status}) + '\n')
+    peak_rss = peak_rss_bytes()
+    # not available on Windows, peak RSS of the process is not reported there
+    peak_rss = '' if peak_rss is None else f", peak RSS of the process {peak_rss / 2 ** 20:.0f} MB"
+    print(f"\nstage times in ms (best of {repeats}), peak MB is the largest allocation peak of one stage traced by tracemalloc"
+          + peak_rss)
+    return failed
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Benchmark stages of the pipeline on the Test inscriptions and check"
+                                                 " their outputs against the reference sorted and classified files.")
+    parser.add_argument("-d", "--test-dir", default=DEFAULT_TEST_DIR, help="Directory with test inscriptions")
+    parser.add_argument("-t", "--tile", type=int, action="append",
+                        help="Stack the inscription this many times to measure large inscriptions, can be repeated"
+                             " (default 1, only the original size is checked against references)")
+    parser.add_argument("-r", "--repeats", type=int, default=5, help="Number of timed runs, the best one is reported")
+    parser.add_argument("-s", "--strategy", choices=SORT_STRATEGIES, default="threshold", help="Row clustering strategy")
+    parser.add_argument("--stand-in", action="store_true",
+                        help="Use a deterministic stand-in classifier, TensorFlow and model files are not needed"
+                             " (classified references are not checked)")
+    parser.add_argument("-a", "--archpath", default=DEFAULT_ARCHITECTURE, help="Path to model architecture in .json format")
+    parser.add_argument("-w", "--weipath", default=DEFAULT_WEIGHTS, help="Path to model weights in .h5 format")
+    parser.add_argument("--tflite",
+                        help="Path to model in .tflite format exported by export_tflite.py, used instead of --archpath and --weipath")
+    parser.add_argument("-c", "--classes", default=DEFAULT_CLASSES, help="Path to dictionary containing classes")
+    parser.add_argument("-b", "--batch-size", type=int, default=64, help="Number of glyphs classified at once")
+    parser.add_argument("--results", help="Append results as JSON lines to this file")
+    args = parser.parse_args()
+
+    classifier = create_classifier(args.stand_in, args.archpath, args.weipath, args.classes, args.batch_size, args.tflite)
+    results_file = open(args.results, 'a') if args.results else None
+    try:
+        failed = benchmark(classifier, find_inscriptions(args.test_dir), args.tile or [1], args.repeats, args.strategy,
+                           not args.stand_in, results_file)
+    finally:
+        if results_file is not None:
+            results_file.close()
+    if failed:
+        print(f"{failed} inscriptions differ from the references")
+        raise SystemExit(1)
@@ -0,0 +1,64 @@
+import argparse
+import base64
+import glob
+import json
+import os
+import time
+import urllib.request
+from concurrent.futures import ThreadPoolExecutor
+import numpy as np
+
+DEFAULT_TEST_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', '..', 'Test')
+
+
+def find_requests(test_dir):
+    """
+    Transcription requests of the Test inscriptions, unsorted single-class YOLO and Roboflow predictions.
+    :return: List of (name, request body).
+    """
+    requests = []
+    for directory in sorted(glob.glob(os.path.join(test_dir, '*'))):
+        name = os.path.basename(directory)
+        images = [filename for filename in glob.glob(os.path.join(directory, name + '.*'))
+                  if os.path.splitext(filename)[1].lower() in ('.jpg', '.png')]
+        if not images:
+            continue
+        with open(images[0], 'rb') as image_file:
+            image = base64.b64encode(image_file.read()).decode('ascii')
+        for polygons_filename in (os.path.join(directory, name + '-yolo-singleclass.txt'),
+                                  os.path.join(directory, name + '-roboflow-singleclass.json')):
+            if os.path.exists(polygons_filename):
+                with open(polygons_filename, 'r') as polygons_file:
+                    body = json.dumps({"image": image, "polygons": polygons_file.read()}).encode('utf-8')
+                requests.append((os.path.basename(polygons_filename), body))
+    return requests
+
+
+def send(url, body):
+    start = time.perf_counter()
+    request = urllib.request.Request(url, data=body, headers={'Content-Type': 'application/json'})
+    with urllib.request.urlopen(request) as response:
+        json.loads(response.read())
+    return time.perf_counter() - start
+
+
+def load_test(url, requests, count, concurrency):
+    bodies = [requests[index % len(requests)][1] for index in range(count)]
+    start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=concurrency) as executor:
+        latencies = np.array(list(executor.map(lambda body: send(url + '/transcribe', body), bodies)))
+    elapsed = time.perf_counter() - start
+    print(f"{count} requests, {concurrency} concurrent: {count / elapsed:.1f} requests/s,"
+          f" p50 {np.percentile(latencies, 50) * 1000:.1f} ms, p99 {np.percentile(latencies, 99) * 1000:.1f} ms")
+    with urllib.request.urlopen(url + '/metrics') as response:
+        print(f"server metrics: {response.read().decode('utf-8')}")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Send the Test inscriptions to a running transcription server.")
+    parser.add_argument("-u", "--url", default="http://127.0.0.1:8080", help="URL of the server")
+    parser.add_argument("-d", "--test-dir", default=DEFAULT_TEST_DIR, help="Directory with test inscriptions")
+    parser.add_argument("-n", "--count", type=int, default=100, help="Number of requests")
+    parser.add_argument("-j", "--concurrency", type=int, default=8, help="Number of concurrent requests")
+    args = parser.parse_args()
+    load_test(args.url, find_requests(args.test_dir), args.count, args.concurrency)
@@ -0,0 +1,254 @@
+import argparse
+import glob
+import os
+import time
+from pipeline import (DEFAULT_ARCHITECTURE, DEFAULT_CLASSES, DEFAULT_WEIGHTS, classify_glyphs, create_classifier,
+                      fuse_predictions, prepare_inscription, save_classified, save_sorted, save_yolo_formatted, timed,
+                      transcription)
+from fusion import FUSION_PREFERENCES, MIN_MATCH_RATE, parse_image_size
+from stage_cache import StageCache
+from row_clustering import SORT_STRATEGIES
+from draw import create_executor
+from images import find_image
+
+STAGES = ['read', 'fuse', 'sort', 'normalize', 'extract', 'classify', 'save']
+OUTPUTS = ['sorted', 'yolo', 'glyphs', 'classified', 'transcript']
+
+
+def fusion_partner(polygons_filename):
+    """
+    Predictions of the other segmentation model of the same inscription,
+    1929-right-roboflow-singleclass.json for 1929-right-yolo-singleclass.txt and the other way round.
+    :return: Filenames of YOLO and Roboflow predictions.
+    """
+    directory, polygons_name = os.path.split(polygons_filename)
+    base_name, ext = os.path.splitext(polygons_name)
+    if '-yolo-' in base_name and ext == '.txt':
+        return polygons_filename, os.path.join(directory, base_name.replace('-yolo-', '-roboflow-', 1) + '.json')
+    if '-roboflow-' in base_name and ext == '.json':
+        return os.path.join(directory, base_name.replace('-roboflow-', '-yolo-', 1) + '.txt'), polygons_filename
+    raise ValueError(f"{polygons_filename} is not named as YOLO (-yolo-*.txt) or Roboflow (-roboflow-*.json) predictions")
+
+
+def find_inscriptions(paths, patterns):
+    """
+    Predictions files in directories (searched recursively for patterns) or glob patterns.
+    :return: Sorted list of predictions filenames.
+    """
+    filenames = set()
+    for path in paths:
+        if os.path.isdir(path):
+            for pattern in patterns:
+                filenames.update(glob.glob(os.path.join(path, '**', pattern), recursive=True))
+        else:
+            filenames.update(glob.glob(path))
+    return sorted(filename for filename in filenames if os.path.isfile(filename))
+
+
+def output_filenames(polygons_filename, output_dir=None):
+    """
+    Filenames of outputs of one inscription, named the same way as in the Test directory.
+    """
+    base_filename, ext = os.path.splitext(polygons_filename)
+    if output_dir is not None:
+        base_filename = os.path.join(output_dir, os.path.basename(base_filename))
+    return {"sorted": f"{base_filename}-sorted{ext}",
+            "yolo": f"{base_filename}-sorted-yolo-formatted.txt",
+            "glyphs": f"{base_filename}-polygons",
+            "classified": f"{base_filename}-polygons-classified.txt",
+            "transcript": f"{base_filename}-transcript.txt"}
+
+
+def run_inscription(classifier, polygons_filename, image_filename, args, executor=None, timings=None, cache=None):
+    """
+    Transcribe one inscription, files are written only for outputs listed in args.save.
+    :return: Dictionary, see pipeline.transcription, with number of glyphs.
+    """
+    timings = {} if timings is None else timings
+    save = set(args.save or [])
+    polygons_format = args.format
+    if args.fuse:
+        yolo_filename, roboflow_filename = fusion_partner(polygons_filename)
+        with timed(timings, 'read'):
+            with open(yolo_filename, 'r') as yolo_file, open(roboflow_filename, 'r') as roboflow_file:
+                yolo_polygons, roboflow_polygons = yolo_file.read(), roboflow_file.read()
+        with timed(timings, 'fuse'):
+            polygons, fusion_counts = fuse_predictions(yolo_polygons, roboflow_polygons, image_filename, args.fuse_iou,
+                                                       args.prefer, args.min_votes, args.roboflow_size, args.min_match_rate)
+        polygons_format = 'yolo'
+        # outputs of fused predictions are named after the YOLO predictions
+        filenames = output_filenames(os.path.splitext(yolo_filename)[0] + '-fused.txt', args.output_dir)
+    else:
+        filenames = output_filenames(polygons_filename, args.output_dir)
+        with timed(timings, 'read'):
+            with open(polygons_filename, 'r') as polygons_file:
+                polygons = polygons_file.read()
+    inscription = prepare_inscription(image_filename, polygons, classifier.imsize, polygons_format, args.strategy,
+                                      args.pixels, filenames["glyphs"] if "glyphs" in save else None, executor, timings,
+                                      cache)
+    with timed(timings, 'classify'):
+        predictions = classify_glyphs(classifier, inscription, cache)
+    result = transcription(inscription["rows"], predictions)
+    result["glyphs"] = len(predictions)
+    if args.fuse:
+        result["fusion"] = fusion_counts
+
+    with timed(timings, 'save'):
+        if save and args.output_dir:
+            os.makedirs(args.output_dir, exist_ok=True)
+        if "sorted" in save:
+            save_sorted(inscription, filenames["sorted"])
+        if "yolo" in save:
+            save_yolo_formatted(inscription["relative"], filenames["yolo"])
+        if "classified" in save:
+            save_classified(predictions, filenames["classified"])
+        if "transcript" in save:
+            with open(filenames["transcript"], 'w') as transcript_file:
+                transcript_file.write(result["transcript"] + '\n')
+    return result
+
+
+def fusion_summary(counts):
+    return ', '.join(f"{count} {name}" for name, count in counts.items()) + " glyphs"
+
+
+def print_timings(rows):
+    """
+    :param rows: List of (name, number of glyphs, timings of stages in seconds).
+    """
+    print(f"{'inscription':50} {'glyphs':>6} " + ' '.join(f"{stage:>9}" for stage in STAGES) + f" {'total':>9}  [ms]")
+    for name, glyphs, timings in rows:
+        print(f"{name:50} {glyphs:6d} " + ' '.join(f"{timings.get(stage, 0) * 1000:9.1f}" for stage in STAGES)
+              + f" {sum(timings.values()) * 1000:9.1f}")
+
+
+def create_cache(args):
+    if not args.cache:
+        return None
+    return StageCache(args.cache, int(args.cache_size * 2 ** 20))
+
+
+def run(args):
+    cache = create_cache(args)
+    start = time.perf_counter()
+    classifier = create_classifier(args.stand_in, args.archpath, args.weipath, args.classes, args.batch_size,
+                                   args.tflite)
+    load_time = time.perf_counter() - start
+
+    image_filename = args.image or find_image(args.polygons)
+    timings = {}
+    result = run_inscription(classifier, args.polygons, image_filename, args, timings=timings, cache=cache)
+    print(result["transcript"])
+    if args.fuse:
+        print(fusion_summary(result["fusion"]))
+    print(f"\nclassifier loaded in {load_time * 1000:.1f} ms")
+    print_timings([(os.path.basename(args.polygons), result["glyphs"], timings)])
+    if cache is not None:
+        print(f"cache: {cache.summary()}")
+
+
+def batch(args):
+    default_patterns = ['*-yolo-singleclass.txt'] if args.fuse else ['*-singleclass.txt', '*-singleclass.json']
+    polygons_filenames = find_inscriptions(args.paths, args.pattern or default_patterns)
+    cache = create_cache(args)
+    start = time.perf_counter()
+    classifier = create_classifier(args.stand_in, args.archpath, args.weipath, args.classes, args.batch_size,
+                                   args.tflite)
+    load_time = time.perf_counter() - start
+
+    start = time.perf_counter()
+    rows = []
+    failed = 0
+    executor = create_executor(args.workers)
+    try:
+        for polygons_filename in polygons_filenames:
+            timings = {}
+            try:
+                result = run_inscription(classifier, polygons_filename, find_image(polygons_filename), args, executor, timings,
+                                         cache)
+            except (OSError, ValueError, KeyError) as error:
+                print(f"{polygons_filename}: FAILED {type(error).__name__}: {error}")
+                failed += 1
+                continue
+            print(f"{polygons_filename}:\n    " + result["transcript"].replace('\n', '\n    '))
+            if args.fuse:
+                print(f"    ({fusion_summary(result['fusion'])})")
+            rows.append((os.path.basename(polygons_filename), result["glyphs"], timings))
+    finally:
+        if executor is not None:
+            executor.shutdown()
+    elapsed = time.perf_counter() - start
+
+    print(f"\nclassifier loaded in {load_time * 1000:.1f} ms")
+    print_timings(rows)
+    totals = {stage: sum(timings.get(stage, 0) for name, glyphs, timings in rows) for stage in STAGES}
+    glyphs = sum(glyphs for name, glyphs, timings in rows)
+    print_timings([('total', glyphs, totals)])
+    print(f"Transcribed {len(rows)} inscriptions ({glyphs} glyphs, {glyphs / max(elapsed, 1e-9):.0f} glyphs/s)"
+          f" in {elapsed:.2f} s, {failed} failed.")
+    if cache is not None:
+        print(f"cache: {cache.summary()}")
+
+
+def add_common_arguments(parser):
+    parser.add_argument("--format", choices=["yolo", "roboflow"], help="Format of predictions (default detected)")
+    parser.add_argument("-s", "--strategy", choices=SORT_STRATEGIES, default="threshold", help="Row clustering strategy")
+    parser.add_argument("--pixels", action="store_true",
+                        help="Crop glyph pixels from the original image instead of drawing white on black masks")
+    parser.add_argument("--fuse", action="store_true",
+                        help="Fuse YOLO and Roboflow predictions of every inscription before sorting, the predictions"
+                             " of the other model are found next to the given ones (-yolo-*.txt and -roboflow-*.json)")
+    parser.add_argument("--fuse-iou", type=float, default=0.5, help="Minimal IoU of bounding boxes of one glyph fused")
+    parser.add_argument("--prefer", choices=FUSION_PREFERENCES, default="yolo",
+                        help="Model whose polygon is kept for glyphs found by both models")
+    parser.add_argument("--min-votes", type=int, choices=[1, 2], default=1,
+                        help="1 keeps glyphs found by any model, 2 only glyphs found by both")
+    parser.add_argument("--roboflow-size", type=parse_image_size,
+                        help="Size WIDTHxHEIGHT of the image Roboflow predicted on, when the predictions do not contain it"
+                             " and the image was resized (default size of the image)")
+    parser.add_argument("--min-match-rate", type=float, default=MIN_MATCH_RATE,
+                        help="Fail fusion when fewer glyphs of the smaller set are matched, 0 disables the check")
+    parser.add_argument("--stand-in", action="store_true",
+                        help="Use a deterministic stand-in classifier, TensorFlow and model files are not needed")
+    parser.add_argument("-a", "--archpath", default=DEFAULT_ARCHITECTURE, help="Path to model architecture in .json format")
+    parser.add_argument("-w", "--weipath", default=DEFAULT_WEIGHTS, help="Path to model weights in .h5 format")
+    parser.add_argument("--tflite",
+                        help="Path to model in .tflite format exported by export_tflite.py, used instead of --archpath and --weipath")
+    parser.add_argument("-c", "--classes", default=DEFAULT_CLASSES, help="Path to dictionary containing classes")
+    parser.add_argument("-b", "--batch-size", type=int, default=64, help="Number of glyphs classified at once")
+    parser.add_argument("--save", action="append", choices=OUTPUTS,
+                        help="Write this output, can be repeated (default nothing is written): sorted predictions,"
+                             " yolo formatted sorted polygons, glyphs PNG folder, classified glyphs, transcript")
+    parser.add_argument("-o", "--output-dir", help="Directory of written outputs (default next to the predictions)")
+    parser.add_argument("--cache", help="Directory of the stage cache, sorted order, glyphs and class probabilities"
+                                        " are reused when their inputs did not change")
+    parser.add_argument("--cache-size", type=float, default=1024,
+                        help="Maximal size of the stage cache in MB, least recently used entries are deleted")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Palmyrene single-class pipeline: sort, normalize, extract and classify"
+                                                 " glyphs in memory.")
+    subparsers = parser.add_subparsers(dest="command")
+
+    run_parser = subparsers.add_parser("run", help="Transcribe one inscription")
+    run_parser.add_argument("polygons", help="Predictions of the segmentation model (YOLO .txt or Roboflow .json)")
+    run_parser.add_argument("-i", "--image", help="Original image (default found next to the predictions)")
+    add_common_arguments(run_parser)
+    run_parser.set_defaults(function=run)
+
+    batch_parser = subparsers.add_parser("batch", help="Transcribe many inscriptions with the classifier loaded once")
+    batch_parser.add_argument("paths", nargs="+", help="Directories (searched recursively) or glob patterns of predictions")
+    batch_parser.add_argument("-p", "--pattern", action="append",
+                              help="Pattern of predictions in directories, can be repeated"
+                                   " (default *-singleclass.txt and *-singleclass.json)")
+    batch_parser.add_argument("-j", "--workers", type=int, default=1,
+                              help="Number of processes extracting glyphs (default 1, in the main process)")
+    add_common_arguments(batch_parser)
+    batch_parser.set_defaults(function=batch)
+
+    args = parser.parse_args()
+    # add_subparsers(required=True) needs Python 3.7
+    if args.command is None:
+        parser.error("a command is required")
+    args.function(args)
@@ -0,0 +1,309 @@
+import json
+import os
+import sys
+import time
+from contextlib import contextmanager
+import numpy as np
+from PIL import Image
+
+TOOLS_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+# the tools are scripts in sibling directories, their modules are imported from there
+for tool_dir in ('Common', 'Sort', 'Draw_Polygons_From_Yolo_Predictions', 'Predict_drawn_polygons'):
+    tool_path = os.path.join(TOOLS_DIR, tool_dir)
+    if tool_path not in sys.path:
+        sys.path.append(tool_path)
+
+from polygon_store import PolygonStore
+from row_clustering import cluster_rows
+from fusion import MIN_MATCH_RATE, fuse_polygons, roboflow_image_size
+from draw import polygon_glyph_arrays
+from glyph_classifier import GlyphClassifier, StandInClassifier, TFLiteGlyphClassifier
+from stage_cache import array_digest, file_digest
+
+DEFAULT_CLASSES = os.path.join(TOOLS_DIR, 'Predict_drawn_polygons', 'classes_all.txt')
+DEFAULT_ARCHITECTURE = os.path.join(TOOLS_DIR, 'Predict_drawn_polygons', 'model_v3_bw.json')
+DEFAULT_WEIGHTS = os.path.join(TOOLS_DIR, 'Predict_drawn_polygons', 'model_v3_bw.h5')
+
+
+def create_classifier(stand_in=False, architecture=DEFAULT_ARCHITECTURE, weights=DEFAULT_WEIGHTS, classes=DEFAULT_CLASSES,
+                      batch_size=64, tflite=None):
+    """
+    Classifier kept loaded for the whole run, the stand-in needs neither TensorFlow nor model files.
+    :param tflite: Path to model exported by export_tflite.py, used instead of the Keras architecture and weights.
+    """
+    if stand_in:
+        return StandInClassifier(classes, batch_size=batch_size)
+    if tflite:
+        return TFLiteGlyphClassifier(tflite, classes, batch_size)
+    return GlyphClassifier(architecture, weights, classes, batch_size)
+
+
+def load_polygons(polygons, polygons_format=None):
+    """
+    Read predictions of the segmentation model.
+    :param polygons: YOLO lines (text), Roboflow predictions (text or parsed dictionary)
+        or PolygonStore in relative coordinates (e.g. fused predictions).
+    :param polygons_format: "yolo" or "roboflow", detected from the data if None.
+    :return: PolygonStore and format, YOLO coordinates are relative, Roboflow coordinates are in pixels.
+    """
+    if isinstance(polygons, PolygonStore):
+        return polygons, 'yolo'
+    if isinstance(polygons, bytes):
+        polygons = polygons.decode('utf-8')
+    if polygons_format is None:
+        polygons_format = 'roboflow' if isinstance(polygons, dict) or polygons.lstrip().startswith('{') else 'yolo'
+    if polygons_format == 'roboflow':
+        if not isinstance(polygons, dict):
+            polygons = json.loads(polygons)
+        return PolygonStore.from_roboflow_json(polygons), polygons_format
+    if polygons_format == 'yolo':
+        return PolygonStore.from_yolo_lines(polygons.splitlines()), polygons_format
+    raise ValueError(f"unknown polygons format {polygons_format}")
+
+
+def fuse_predictions(yolo_polygons, roboflow_polygons, image, min_iou=0.5, prefer='yolo', min_votes=1, roboflow_size=None,
+                     min_match_rate=MIN_MATCH_RATE):
+    """
+    Fuse predictions of both segmentation models of one inscription, see fusion.fuse_polygons.
+    :param yolo_polygons: YOLO lines (text).
+    :param roboflow_polygons: Roboflow predictions (text or parsed dictionary).
+    :param image: Path or file object of the original image.
+    :param roboflow_size: Size (width, height) of the image Roboflow predicted on, see fusion.roboflow_image_size.
+    :return: PolygonStore in relative coordinates and dictionary with numbers of matched and unmatched glyphs.
+    """
+    yolo_polygons, _ = load_polygons(yolo_polygons, 'yolo')
+    if not isinstance(roboflow_polygons, dict):
+        roboflow_polygons = json.loads(roboflow_polygons)
+    image_size = roboflow_image_size(roboflow_polygons, read_image_size(image), roboflow_size)
+    roboflow_polygons, _ = load_polygons(roboflow_polygons, 'roboflow')
+    return fuse_polygons(yolo_polygons, roboflow_polygons, image_size, min_iou, prefer, min_votes, min_match_rate)
+
+
+def read_image_size(image):
+    """
+    Size (width, height) of the image, only its header is read.
+    :param image: Path or file object.
+    """
+    with Image.open(image) as original_image:
+        size = original_image.size
+    if hasattr(image, 'seek'):
+        image.seek(0)
+    return size
+
+
+def sort_order(polygons, strategy='threshold'):
+    """
+    Reading order of polygons.
+    :return: Array of indices of polygons in reading order and array of lengths of rows.
+    """
+    rows = cluster_rows(polygons, strategy)
+    if not rows:
+        return np.zeros(0, dtype=np.int64), np.zeros(0, dtype=np.int64)
+    return np.concatenate(rows), np.array([len(row) for row in rows], dtype=np.int64)
+
+
+def apply_order(polygons, order, row_lengths):
+    """
+    :return: PolygonStore with sorted polygons and list of rows with positions of polygons in the sorted store.
+    """
+    row_ends = np.cumsum(row_lengths).tolist()
+    rows = [list(range(end - length, end)) for length, end in zip(row_lengths.tolist(), row_ends)]
+    return polygons.take(order), rows
+
+
+def sort_polygons(polygons, strategy='threshold'):
+    """
+    Sort polygons in reading order.
+    :return: PolygonStore with sorted polygons and list of rows with positions of polygons in the sorted store.
+    """
+    return apply_order(polygons, *sort_order(polygons, strategy))
+
+
+def relative_polygons(polygons, polygons_format, image_size):
+    """
+    Polygons in relative coordinates of YOLO format, Roboflow pixels are converted the same way as json_to_yolo.py does.
+    """
+    if polygons_format == 'yolo':
+        return polygons
+    return polygons.to_relative(image_size)
+
+
+def extract_glyphs(polygons, image, imsize, source_pixels=False, dump_dir=None, executor=None, names=None):
+    """
+    Glyphs of polygons in relative coordinates as uint8 array of shape (N, imsize, imsize) in the order of polygons.
+    :param names: Index of every polygon in the names of saved glyphs, its position by default.
+    """
+    coordinates = polygons.decimal_vertices().ravel().tolist()
+    starts = (polygons.offsets * 2).tolist()
+    names = range(len(polygons)) if names is None else names
+    indexed = ((name, coordinates[starts[index]:starts[index + 1]]) for index, name in enumerate(names))
+    indices, glyphs = polygon_glyph_arrays(indexed, image, imsize, executor, dump_dir, source_pixels)
+    return glyphs
+
+
+@contextmanager
+def timed(timings, stage):
+    """
+    Add seconds spent in the block to timings[stage].
+    """
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        timings[stage] = timings.get(stage, 0) + time.perf_counter() - start
+
+
+def prepare_inscription(image, polygons, imsize, polygons_format=None, strategy='threshold', source_pixels=False,
+                        dump_dir=None, executor=None, timings=None, cache=None):
+    """
+    Sort predictions of the segmentation model and extract their glyphs for the classifier.
+    :param image: Path or file object of the original image.
+    :param polygons: Predictions of the segmentation model, see load_polygons.
+    :param imsize: Input size of the classifier.
+    :param dump_dir: Also save glyphs as polygon_{index}.png to this directory.
+    :param timings: Dictionary, seconds spent in every stage are added to it.
+    :param cache: StageCache, sorted order and glyphs are reused when their inputs did not change.
+        Glyphs are cached in the order of the predictions, so they are reused with any sorting strategy.
+    :return: Dictionary with format of predictions, sorted polygons (in coordinates of the format),
+        relative (sorted polygons in YOLO coordinates), rows with positions of glyphs,
+        glyphs (uint8 array of shape (N, imsize, imsize) in sorted order), order (indices of predictions
+        in sorted order) and key of glyphs in the cache (None without cache).
+    """
+    timings = {} if timings is None else timings
+    with timed(timings, 'read'):
+        polygons, polygons_format = load_polygons(polygons, polygons_format)
+        image_size = read_image_size(image)
+
+    with timed(timings, 'sort'):
+        sort_key = None
+        cached = None
+        if cache is not None:
+            polygons_digest = array_digest(polygons.vertices, polygons.offsets, polygons.class_ids)
+            sort_key = cache.key('sort', polygons_digest, strategy)
+            cached = cache.get(sort_key)
+        if cached is None:
+            order, row_lengths = sort_order(polygons, strategy)
+            if cache is not None:
+                cache.put(sort_key, order=order, row_lengths=row_lengths)
+        else:
+            order, row_lengths = cached["order"], cached["row_lengths"]
+        sorted_polygons, rows = apply_order(polygons, order, row_lengths)
+
+    with timed(timings, 'normalize'):
+        unsorted_relative = relative_polygons(polygons, polygons_format, image_size)
+        relative = unsorted_relative.take(order)
+
+    with timed(timings, 'extract'):
+        glyphs_key = None
+        cached = None
+        if cache is not None:
+            # glyphs do not depend on the order, so they are keyed on the unsorted predictions
+            glyphs_key = cache.key('extract', polygons_digest, polygons_format, file_digest(image), imsize,
+                                   source_pixels)
+            # glyph images have to be drawn anyway when they are saved
+            if dump_dir is None:
+                cached = cache.get(glyphs_key)
+        if cached is None:
+            # saved glyphs are named by their sorted position
+            sorted_positions = np.empty(len(order), dtype=np.int64)
+            sorted_positions[order] = np.arange(len(order))
+            unsorted_glyphs = extract_glyphs(unsorted_relative, image, imsize, source_pixels, dump_dir, executor,
+                                             sorted_positions.tolist())
+            if cache is not None:
+                cache.put(glyphs_key, glyphs=unsorted_glyphs)
+        else:
+            unsorted_glyphs = cached["glyphs"]
+        glyphs = unsorted_glyphs[order]
+    return {"format": polygons_format, "sorted": sorted_polygons, "relative": relative, "rows": rows, "glyphs": glyphs,
+            "order": order, "key": glyphs_key}
+
+
+def classify_glyphs(classifier, inscription, cache=None):
+    """
+    Classify glyphs of the inscription, class probabilities are reused from the cache when neither glyphs nor model changed.
+    Probabilities are cached in the order of the predictions, as glyphs are.
+    :param inscription: Dictionary, see prepare_inscription.
+    :return: List of (predicted class name, certainty).
+    """
+    order = inscription["order"]
+    cached = None
+    if cache is not None:
+        probabilities_key = cache.key('classify', inscription["key"], classifier.fingerprint)
+        cached = cache.get(probabilities_key)
+    if cached is None:
+        probabilities = classifier.predict_batch_probabilities(inscription["glyphs"])
+        if cache is not None:
+            unsorted_probabilities = np.empty_like(probabilities)
+            unsorted_probabilities[order] = probabilities
+            cache.put(probabilities_key, probabilities=unsorted_probabilities)
+    else:
+        probabilities = cached["probabilities"][order]
+    return classifier.class_predictions(probabilities)
+
+
+def prepare_glyphs(image, polygons, imsize, polygons_format=None, strategy='threshold', source_pixels=False,
+                   dump_dir=None, executor=None, timings=None):
+    """
+    Sort predictions and extract their glyphs, see prepare_inscription.
+    :return: List of rows with positions of glyphs and uint8 array of glyphs of shape (N, imsize, imsize).
+    """
+    inscription = prepare_inscription(image, polygons, imsize, polygons_format, strategy, source_pixels, dump_dir,
+                                      executor, timings)
+    return inscription["rows"], inscription["glyphs"]
+
+
+def save_sorted(inscription, filename):
+    """
+    Save sorted polygons in the format of the predictions, as sort.py and sort_json.py do.
+    """
+    with open(filename, 'w') as file:
+        if inscription["format"] == 'roboflow':
+            json.dump(inscription["sorted"].to_roboflow_json(), file, indent=4)
+        else:
+            file.writelines(inscription["sorted"].to_yolo_lines())
+
+
+def save_yolo_formatted(relative, filename):
+    """
+    Save polygons in relative coordinates with 6 decimals, as json_to_yolo.py does.
+    """
+    coordinates = [f"{value:.6f}" for value in relative.decimal_vertices().ravel().tolist()]
+    starts = (relative.offsets * 2).tolist()
+    with open(filename, 'w') as file:
+        for index, class_id in enumerate(relative.class_ids.tolist()):
+            file.write(f"{class_id} {' '.join(coordinates[starts[index]:starts[index + 1]])}\n")
+
+
+def save_classified(predictions, filename):
+    """
+    Save predictions of glyphs in the output format of predict_polygons.py.
+    """
+    with open(filename, 'w') as file:
+        for index, (predicted_class_name, certainty) in enumerate(predictions):
+            print({f"polygon_{index}.png"}, " : ", {predicted_class_name}, file=file)
+
+
+def transcription(rows, predictions):
+    """
+    :param rows: List of rows with positions of glyphs.
+    :param predictions: List of (class name, certainty) of every glyph.
+    :return: Dictionary with transcript (rows on separate lines) and class and certainty of every glyph in rows.
+    """
+    glyph_rows = [[{"class": predictions[position][0], "certainty": float(predictions[position][1])} for position in row]
+                  for row in rows]
+    transcript = '\n'.join(' '.join(glyph["class"] for glyph in row) for row in glyph_rows)
+    return {"transcript": transcript, "rows": glyph_rows}
+
+
+def transcribe(classifier, image, polygons, polygons_format=None, strategy='threshold', source_pixels=False,
+               dump_dir=None, executor=None, timings=None, cache=None):
+    """
+    Sort, extract and classify glyphs of one inscription in memory.
+    :return: Dictionary, see transcription.
+    """
+    timings = {} if timings is None else timings
+    inscription = prepare_inscription(image, polygons, classifier.imsize, polygons_format, strategy, source_pixels,
+                                      dump_dir, executor, timings, cache)
+    with timed(timings, 'classify'):
+        predictions = classify_glyphs(classifier, inscription, cache)
+    return transcription(inscription["rows"], predictions)
@@ -0,0 +1,248 @@
+import argparse
+import base64
+import binascii
+import io
+import json
+import queue
+import socketserver
+import threading
+import time
+from collections import deque
+from concurrent.futures import Future
+from http.server import BaseHTTPRequestHandler, HTTPServer
+import numpy as np
+from PIL import UnidentifiedImageError
+from pipeline import DEFAULT_ARCHITECTURE, DEFAULT_CLASSES, DEFAULT_WEIGHTS, create_classifier, prepare_glyphs, transcription
+from row_clustering import SORT_STRATEGIES
+
+# errors caused by the request (malformed JSON, missing fields, undecodable image or polygons), answered with 400
+CLIENT_ERRORS = (KeyError, TypeError, ValueError, AttributeError, OSError, binascii.Error, UnidentifiedImageError)
+
+
+class ThreadingHTTPServer(socketserver.ThreadingMixIn, HTTPServer):
+    # http.server.ThreadingHTTPServer is only available since Python 3.7
+    daemon_threads = True
+
+
+class GlyphBatcher:
+    """
+    Classifies glyphs of concurrent requests together.
+    Requests put their glyphs in a queue, one thread takes everything that arrives within max_wait seconds
+    (at most max_batch glyphs) and classifies it in one call of the classifier.
+    """
+
+    def __init__(self, classifier, max_batch=256, max_wait=0.005):
+        self.classifier = classifier
+        self.max_batch = max_batch
+        self.max_wait = max_wait
+        self.batches = 0
+        self.batched_glyphs = 0
+        self._queue = queue.Queue()
+        self._thread = threading.Thread(target=self._run, daemon=True)
+        self._thread.start()
+
+    def classify(self, glyphs):
+        """
+        Classify glyphs of one request, blocks until its batch is classified.
+        :return: List of (predicted class name, certainty).
+        """
+        if len(glyphs) == 0:
+            return []
+        future = Future()
+        self._queue.put((glyphs, future))
+        return future.result()
+
+    def close(self):
+        self._queue.put(None)
+        self._thread.join()
+
+    def _run(self):
+        while True:
+            item = self._queue.get()
+            if item is None:
+                return
+            items = [item]
+            count = len(item[0])
+            deadline = time.monotonic() + self.max_wait
+            closing = False
+            while count < self.max_batch:
+                try:
+                    item = self._queue.get(timeout=max(deadline - time.monotonic(), 0))
+                except queue.Empty:
+                    break
+                if item is None:
+                    closing = True
+                    break
+                items.append(item)
+                count += len(item[0])
+            self._classify(items)
+            if closing:
+                return
+
+    def _classify(self, items):
+        try:
+            predictions = self.classifier.predict_batch(np.concatenate([glyphs for glyphs, future in items]))
+        except Exception as error:
+            for glyphs, future in items:
+                future.set_exception(error)
+            return
+        self.batches += 1
+        self.batched_glyphs += len(predictions)
+        start = 0
+        for glyphs, future in items:
+            future.set_result(predictions[start:start + len(glyphs)])
+            start += len(glyphs)
+
+
+class LatencyMetrics:
+    """
+    Latencies of the last requests, percentiles are computed on request.
+    """
+
+    def __init__(self, window=10000):
+        self.requests = 0
+        self.errors = 0
+        self._latencies = deque(maxlen=window)
+        self._lock = threading.Lock()
+
+    def record(self, seconds, error=False):
+        with self._lock:
+            self.requests += 1
+            self.errors += error
+            if not error:
+                self._latencies.append(seconds)
+
+    def snapshot(self):
+        with self._lock:
+            latencies = np.array(self._latencies)
+            requests, errors = self.requests, self.errors
+        metrics = {"requests": requests, "errors": errors}
+        if len(latencies):
+            metrics.update({"p50_ms": float(np.percentile(latencies, 50) * 1000),
+                            "p99_ms": float(np.percentile(latencies, 99) * 1000),
+                            "max_ms": float(latencies.max() * 1000)})
+        return metrics
+
+
+class TranscriptionHandler(BaseHTTPRequestHandler):
+    """
+    POST /transcribe with JSON {"image": base64 image, "polygons": YOLO text or Roboflow predictions,
+    "format": optional "yolo" or "roboflow", "strategy": optional row clustering strategy},
+    GET /metrics and GET /health.
+    """
+
+    def do_GET(self):
+        if self.path == '/health':
+            self.send_json(200, {"status": "ok"})
+        elif self.path == '/metrics':
+            batcher = self.server.batcher
+            metrics = self.server.metrics.snapshot()
+            metrics.update({"batches": batcher.batches,
+                            "mean_batch_glyphs": batcher.batched_glyphs / max(batcher.batches, 1)})
+            self.send_json(200, metrics)
+        else:
+            self.send_json(404, {"error": f"unknown path {self.path}"})
+
+    def do_POST(self):
+        if self.path != '/transcribe':
+            self.send_json(404, {"error": f"unknown path {self.path}"})
+            return
+        start = time.perf_counter()
+        try:
+            status, result = self.transcribe()
+        except CLIENT_ERRORS as error:
+            status, result = 400, {"error": f"{type(error).__name__}: {error}"}
+        except Exception as error:
+            status, result = 500, {"error": f"{type(error).__name__}: {error}"}
+        self.server.metrics.record(time.perf_counter() - start, error=status != 200)
+        self.send_json(status, result)
+
+    def transcribe(self):
+        """
+        Transcribe the posted inscription, CLIENT_ERRORS raised while it is prepared are answered with 400,
+        failures of the classifier and other exceptions with 500.
+        :return: HTTP status and response.
+        """
+        request = json.loads(self.rfile.read(int(self.headers.get('Content-Length', 0))))
+        image = io.BytesIO(base64.b64decode(request["image"], validate=True))
+        strategy = request.get("strategy", self.server.strategy)
+        if strategy not in SORT_STRATEGIES:
+            raise ValueError(f"unknown strategy {strategy}")
+        if not isinstance(request["polygons"], (str, dict)):
+            raise ValueError("polygons must be YOLO text or Roboflow predictions")
+        timings = {}
+        rows, glyphs = prepare_glyphs(image, request["polygons"], self.server.batcher.classifier.imsize,
+                                      request.get("format"), strategy, self.server.source_pixels, timings=timings)
+
+        classify_start = time.perf_counter()
+        try:
+            predictions = self.server.batcher.classify(glyphs)
+        except Exception as error:
+            return 500, {"error": f"{type(error).__name__}: {error}"}
+        timings['classify'] = time.perf_counter() - classify_start
+        result = transcription(rows, predictions)
+        result["timings_ms"] = {stage: seconds * 1000 for stage, seconds in timings.items()}
+        return 200, result
+
+    def send_json(self, status, data):
+        body = json.dumps(data).encode('utf-8')
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        if self.server.verbose:
+            super().log_message(format, *args)
+
+
+def create_server(classifier, host='127.0.0.1', port=8080, strategy='threshold', source_pixels=False, max_batch=256,
+                  max_wait=0.005, verbose=False):
+    """
+    HTTP server with the classifier loaded once, every request is handled in its own thread,
+    glyphs of concurrent requests are classified in shared batches.
+    """
+    server = ThreadingHTTPServer((host, port), TranscriptionHandler)
+    server.batcher = GlyphBatcher(classifier, max_batch, max_wait)
+    server.metrics = LatencyMetrics()
+    server.strategy = strategy
+    server.source_pixels = source_pixels
+    server.verbose = verbose
+    return server
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Local HTTP transcription service with the classifier kept loaded.")
+    parser.add_argument("--host", default="127.0.0.1", help="Address to listen on")
+    parser.add_argument("--port", type=int, default=8080, help="Port to listen on")
+    parser.add_argument("--stand-in", action="store_true",
+                        help="Use a deterministic stand-in classifier, TensorFlow and model files are not needed")
+    parser.add_argument("-a", "--archpath", default=DEFAULT_ARCHITECTURE, help="Path to model architecture in .json format")
+    parser.add_argument("-w", "--weipath", default=DEFAULT_WEIGHTS, help="Path to model weights in .h5 format")
+    parser.add_argument("--tflite",
+                        help="Path to model in .tflite format exported by export_tflite.py, used instead of --archpath and --weipath")
+    parser.add_argument("-c", "--classes", default=DEFAULT_CLASSES, help="Path to dictionary containing classes")
+    parser.add_argument("-s", "--strategy", choices=SORT_STRATEGIES, default="threshold",
+                        help="Default row clustering strategy")
+    parser.add_argument("--pixels", action="store_true",
+                        help="Crop glyph pixels from the original image instead of drawing white on black masks")
+    parser.add_argument("--max-batch", type=int, default=256, help="Maximal number of glyphs classified at once")
+    parser.add_argument("--max-wait-ms", type=float, default=5,
+                        help="How long glyphs wait for glyphs of other requests to share a batch")
+    parser.add_argument("-v", "--verbose", action="store_true", help="Log every request")
+    args = parser.parse_args()
+
+    classifier = create_classifier(args.stand_in, args.archpath, args.weipath, args.classes, args.max_batch, args.tflite)
+    classifier.warm_up()
+    server = create_server(classifier, args.host, args.port, args.strategy, args.pixels, args.max_batch,
+                           args.max_wait_ms / 1000, args.verbose)
+    print(f"Listening on http://{args.host}:{args.port}/transcribe")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+        server.batcher.close()
+        print(json.dumps(server.metrics.snapshot()))
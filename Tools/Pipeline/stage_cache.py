@@ -0,0 +1,135 @@
+import hashlib
+import json
+import os
+import tempfile
+import numpy as np
+
+# changes of stage outputs for the same inputs (e.g. a fix of sorting) must change this version
+CACHE_VERSION = 1
+
+
+def file_digest(file, chunk_size=1 << 20):
+    """
+    SHA-256 of the content of a file.
+    :param file: Path or file object, the position of file objects is restored.
+    """
+    digest = hashlib.sha256()
+    if hasattr(file, 'read'):
+        position = file.tell()
+        for chunk in iter(lambda: file.read(chunk_size), b''):
+            digest.update(chunk)
+        file.seek(position)
+    else:
+        with open(file, 'rb') as opened_file:
+            for chunk in iter(lambda: opened_file.read(chunk_size), b''):
+                digest.update(chunk)
+    return digest.hexdigest()
+
+
+def array_digest(*arrays):
+    digest = hashlib.sha256()
+    for array in arrays:
+        array = np.ascontiguousarray(array)
+        digest.update(f"{array.dtype.str}{array.shape}".encode('ascii'))
+        digest.update(array.tobytes())
+    return digest.hexdigest()
+
+
+class StageCache:
+    """
+    On-disk cache of stage outputs (arrays) keyed by hashes of everything the stage depends on.
+    Entries are .npz files named by their key, a hit refreshes the modification time of the entry
+    and the least recently used entries are deleted when the cache grows over max_bytes.
+    """
+
+    def __init__(self, directory, max_bytes=1 << 30):
+        self.directory = directory
+        self.max_bytes = max_bytes
+        self.hits = {}
+        self.misses = {}
+        os.makedirs(directory, exist_ok=True)
+        # name -> (last use, size) of all entries, the directory is scanned only once
+        self._entries = {}
+        for entry in os.scandir(directory):
+            if entry.is_file() and entry.name.endswith('.npz'):
+                stat = entry.stat()
+                self._entries[entry.name] = (stat.st_mtime, stat.st_size)
+        self._total_bytes = sum(size for last_use, size in self._entries.values())
+        # the cache may have been filled with a larger limit
+        self.evict()
+
+    @staticmethod
+    def key(stage, *parts):
+        """
+        Key of a stage output.
+        :param stage: Name of the stage.
+        :param parts: Digests of inputs and parameters of the stage, anything serializable to JSON.
+        """
+        text = json.dumps([CACHE_VERSION, stage, *parts], sort_keys=True, default=str)
+        return f"{stage}-{hashlib.sha256(text.encode('utf-8')).hexdigest()}"
+
+    def get(self, key):
+        """
+        :return: Dictionary of arrays stored under the key, None if there is no such entry.
+        """
+        stage = key.split('-', 1)[0]
+        name = key + '.npz'
+        path = os.path.join(self.directory, name)
+        try:
+            with np.load(path, allow_pickle=False) as data:
+                arrays = {array_name: data[array_name] for array_name in data.files}
+        except (OSError, ValueError):
+            # missing entry, or an entry evicted or damaged by another process
+            self._forget(name)
+            self.misses[stage] = self.misses.get(stage, 0) + 1
+            return None
+        os.utime(path)
+        stat = os.stat(path)
+        self._forget(name)
+        self._entries[name] = (stat.st_mtime, stat.st_size)
+        self._total_bytes += stat.st_size
+        self.hits[stage] = self.hits.get(stage, 0) + 1
+        return arrays
+
+    def put(self, key, **arrays):
+        """
+        Store arrays under the key, the entry is written to a temporary file and renamed,
+        so readers never see a partial entry.
+        """
+        name = key + '.npz'
+        file_descriptor, temporary_path = tempfile.mkstemp(dir=self.directory, suffix='.tmp')
+        try:
+            with os.fdopen(file_descriptor, 'wb') as file:
+                np.savez(file, **arrays)
+            os.replace(temporary_path, os.path.join(self.directory, name))
+        except BaseException:
+            os.unlink(temporary_path)
+            raise
+        self._forget(name)
+        stat = os.stat(os.path.join(self.directory, name))
+        self._entries[name] = (stat.st_mtime, stat.st_size)
+        self._total_bytes += stat.st_size
+        self.evict()
+
+    def evict(self):
+        """
+        Delete least recently used entries until the cache fits in max_bytes.
+        """
+        if self._total_bytes <= self.max_bytes:
+            return
+        for name, (last_use, size) in sorted(self._entries.items(), key=lambda item: item[1][0]):
+            if self._total_bytes <= self.max_bytes:
+                break
+            try:
+                os.unlink(os.path.join(self.directory, name))
+            except FileNotFoundError:
+                pass
+            self._forget(name)
+
+    def _forget(self, name):
+        if name in self._entries:
+            self._total_bytes -= self._entries.pop(name)[1]
+
+    def summary(self):
+        stages = sorted(set(self.hits) | set(self.misses))
+        return ', '.join(f"{stage} {self.hits.get(stage, 0)} hits {self.misses.get(stage, 0)} misses" for stage in stages)
@@ -0,0 +1,115 @@
+import argparse
+import glob
+import os
+import time
+import numpy as np
+from glyph_classifier import GlyphClassifier, TFLiteGlyphClassifier, list_images, load_image_batch, read_classified
+
+DEFAULT_TEST_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', '..', 'Test')
+QUANTIZATIONS = ['int8', 'float16', 'dynamic', 'float32']
+
+
+def representative_glyphs(glyph_dirs, imsize, count=500):
+    """
+    Glyph images used to calibrate ranges of int8 activations.
+    :return: float32 array of shape (N, imsize, imsize, 1) scaled to 0-1 as the classifier gets it.
+    """
+    image_paths = [os.path.join(glyph_dir, image_file) for glyph_dir in glyph_dirs for image_file in list_images(glyph_dir)]
+    if not image_paths:
+        raise ValueError("no glyph images for calibration of int8 quantization")
+    glyphs = load_image_batch(image_paths[:count], imsize)
+    return glyphs.reshape((len(glyphs), imsize, imsize, 1)).astype('float32') / 255
+
+
+def convert(model, quantization, representative=None):
+    """
+    Convert the Keras model to TensorFlow Lite.
+    :param quantization: "int8" (weights and activations, needs representative glyphs), "float16" (weights),
+        "dynamic" (int8 weights, float activations) or "float32" (no quantization).
+    :return: Content of the .tflite file.
+    """
+    import tensorflow as tf
+
+    converter = tf.lite.TFLiteConverter.from_keras_model(model)
+    if quantization != 'float32':
+        converter.optimizations = [tf.lite.Optimize.DEFAULT]
+    if quantization == 'float16':
+        converter.target_spec.supported_types = [tf.float16]
+    elif quantization == 'int8':
+        converter.representative_dataset = lambda: ([glyph[np.newaxis]] for glyph in representative)
+        converter.target_spec.supported_ops = [tf.lite.OpsSet.TFLITE_BUILTINS_INT8]
+        converter.inference_input_type = tf.int8
+        converter.inference_output_type = tf.int8
+    return converter.convert()
+
+
+def compare(float_classifier, quantized_classifier, test_dir):
+    """
+    Classify glyphs of the Test inscriptions by both classifiers and compare them with the reference
+    *-polygons-classified.txt files.
+    :return: Number of glyphs whose class differs between the classifiers.
+    """
+    print(f"{'glyphs':50} {'count':>5} {'float ok':>8} {'quantized ok':>12} {'changed':>7} {'max diff':>8}")
+    changed_total = 0
+    for classified_filename in sorted(glob.glob(os.path.join(test_dir, '*', '*-polygons-classified.txt'))):
+        glyph_dir = classified_filename[:-len('-classified.txt')]
+        if not os.path.isdir(glyph_dir):
+            continue
+        reference = read_classified(classified_filename)
+        image_files = list_images(glyph_dir)
+        glyphs = load_image_batch([os.path.join(glyph_dir, image_file) for image_file in image_files], float_classifier.imsize)
+        float_probabilities = float_classifier.predict_batch_probabilities(glyphs)
+        quantized_probabilities = quantized_classifier.predict_batch_probabilities(glyphs)
+        float_classes = [class_name for class_name, certainty in float_classifier.class_predictions(float_probabilities)]
+        quantized_classes = [class_name for class_name, certainty in
+                             quantized_classifier.class_predictions(quantized_probabilities)]
+        float_ok = sum(reference.get(image_file) == class_name for image_file, class_name in zip(image_files, float_classes))
+        quantized_ok = sum(reference.get(image_file) == class_name
+                           for image_file, class_name in zip(image_files, quantized_classes))
+        changed = sum(float_class != quantized_class for float_class, quantized_class in zip(float_classes, quantized_classes))
+        max_difference = float(np.abs(float_probabilities - quantized_probabilities).max()) if len(glyphs) else 0.0
+        changed_total += changed
+        print(f"{os.path.basename(glyph_dir):50} {len(glyphs):5d} {float_ok:8d} {quantized_ok:12d} {changed:7d}"
+              f" {max_difference:8.4f}")
+    return changed_total
+
+
+def timed_load(create):
+    start = time.perf_counter()
+    classifier = create()
+    return classifier, time.perf_counter() - start
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Export the glyph classifier to TensorFlow Lite for CPU inference"
+                                                 " and compare it with the Keras model on the Test inscriptions.")
+    parser.add_argument("--archpath", "-a", type=str, default="./model_v3_bw.json", help="Path to model architecture in .json format.")
+    parser.add_argument("--weipath", "-w", type=str, default="./model_v3_bw.h5", help="Path to model weights in .h5 format.")
+    parser.add_argument("--classes", "-c", type=str, default="./classes_all.txt", help="Path to dictionary containing classes.")
+    parser.add_argument("--output", "-o", type=str, help="Path of the .tflite model (default <weights>-<quantization>.tflite).")
+    parser.add_argument("--quantize", "-q", choices=QUANTIZATIONS, default="int8",
+                        help="Quantization of the exported model (default int8 weights and activations).")
+    parser.add_argument("--representative", "-r", action="append",
+                        help="Directory of glyph images for calibration of int8 quantization, can be repeated"
+                             " (default glyph directories of the Test inscriptions).")
+    parser.add_argument("--test-dir", "-d", type=str, default=DEFAULT_TEST_DIR,
+                        help="Directory with test inscriptions, classes of both models are compared on their glyphs.")
+    parser.add_argument("--no-compare", action="store_true", help="Only export the model.")
+    args = parser.parse_args()
+
+    output = args.output or f"{os.path.splitext(args.weipath)[0]}-{args.quantize}.tflite"
+    float_classifier, float_load_time = timed_load(lambda: GlyphClassifier(args.archpath, args.weipath, args.classes))
+    representative = None
+    if args.quantize == 'int8':
+        glyph_dirs = args.representative or sorted(glob.glob(os.path.join(args.test_dir, '*', '*-polygons')))
+        representative = representative_glyphs(glyph_dirs, float_classifier.imsize)
+    with open(output, 'wb') as model_file:
+        model_file.write(convert(float_classifier.model, args.quantize, representative))
+    print(f"{args.quantize} model saved to {output} ({os.path.getsize(output) / 2 ** 20:.2f} MB,"
+          f" weights {os.path.getsize(args.weipath) / 2 ** 20:.2f} MB)")
+
+    if not args.no_compare:
+        quantized_classifier, quantized_load_time = timed_load(lambda: TFLiteGlyphClassifier(output, args.classes))
+        print(f"loaded in {float_load_time * 1000:.0f} ms (Keras) and {quantized_load_time * 1000:.0f} ms (TensorFlow Lite)")
+        changed = compare(float_classifier, quantized_classifier, args.test_dir)
+        print(f"{changed} glyphs classified differently by the {args.quantize} model")
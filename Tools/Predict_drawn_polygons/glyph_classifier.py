@@ -0,0 +1,376 @@
+import ast
+import hashlib
+import os
+import re
+import sys
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+import numpy as np
+import cv2
+from PIL import Image
+
+DRAW_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'Draw_Polygons_From_Yolo_Predictions')
+
+
+def parse_class_names(text):
+    """
+    Parse the class labels dictionary {index: "class name", ...} without evaluating any code.
+    :return: List of class names ordered by their index.
+    """
+    classes_dict = ast.literal_eval(text)
+    if not isinstance(classes_dict, dict) or not all(isinstance(key, int) for key in classes_dict):
+        raise ValueError("class labels must be a dictionary {index: class name}")
+    if sorted(classes_dict) != list(range(len(classes_dict))):
+        raise ValueError("class indices must be 0 to number of classes - 1")
+    return [str(classes_dict[index]) for index in range(len(classes_dict))]
+
+
+def load_class_names(classes_path):
+    with open(classes_path, 'r') as classes_file:
+        return parse_class_names(classes_file.read())
+
+
+def read_classified(filename):
+    """
+    Read predictions printed by predict_polygons.py, lines {'polygon_0.png'}  :  {'aleph'}.
+    :return: Dictionary glyph name -> class name.
+    """
+    classes = {}
+    with open(filename, 'r') as file:
+        for line in file:
+            if not line.strip():
+                continue
+            glyph, class_name = line.split(':', 1)
+            glyph_name, = ast.literal_eval(glyph.strip())
+            class_name, = ast.literal_eval(class_name.strip())
+            classes[glyph_name] = class_name
+    return classes
+
+
+def files_digest(*paths):
+    """
+    SHA-256 of the content of all files.
+    """
+    digest = hashlib.sha256()
+    for path in paths:
+        with open(path, 'rb') as file:
+            for chunk in iter(lambda: file.read(1 << 20), b''):
+                digest.update(chunk)
+    return digest.hexdigest()
+
+
+def glyph_sort_key(filename):
+    # numbers in names are compared as numbers, polygon_2.png comes before polygon_10.png
+    return [int(part) if part.isdigit() else part for part in re.split(r'(\d+)', filename)]
+
+
+def list_images(image_dir):
+    """
+    :return: Filenames of images in the directory in the order of glyphs.
+    """
+    return sorted((f for f in os.listdir(image_dir) if os.path.isfile(os.path.join(image_dir, f))), key=glyph_sort_key)
+
+
+def resize_batch(pixels, imsize):
+    """
+    Bilinear resize of images of the same size to imsize x imsize, equal to resizing every image by PIL.
+    PIL resizes rows first and columns of the result second, so rows of all images are resized at once
+    as one image of the images stacked below each other and columns as one image of the images side by side.
+    :param pixels: uint8 array of shape (N, H, W) or (N, H, W, channels).
+    :return: uint8 array of shape (N, imsize, imsize) or (N, imsize, imsize, channels).
+    """
+    count, height, width = pixels.shape[:3]
+    channels = pixels.shape[3:]
+    if count == 0 or (height, width) == (imsize, imsize):
+        return pixels
+    rows = Image.fromarray(np.ascontiguousarray(pixels).reshape((count * height, width) + channels))
+    rows = np.asarray(rows.resize((imsize, count * height), Image.BILINEAR))
+    columns = rows.reshape((count, height, imsize) + channels).swapaxes(0, 1).reshape((height, count * imsize) + channels)
+    columns = np.asarray(Image.fromarray(np.ascontiguousarray(columns)).resize((count * imsize, imsize), Image.BILINEAR))
+    return columns.reshape((imsize, count, imsize) + channels).swapaxes(0, 1)
+
+
+def decode_image(image_path):
+    """
+    :return: uint8 array of BGR pixels of shape (H, W, 3), cv2 decodes PNG files faster than PIL with the same pixels.
+    """
+    pixels = cv2.imread(image_path, cv2.IMREAD_COLOR)
+    if pixels is None:
+        # format cv2 can not read
+        with Image.open(image_path) as img:
+            return np.ascontiguousarray(np.asarray(img.convert('RGB'))[:, :, ::-1])
+    return pixels
+
+
+def load_image_batch(image_paths, imsize):
+    """
+    Load and preprocess images as the classifier was trained: bilinear resize by PIL and grayscale conversion
+    by cv2 COLOR_BGR2GRAY of RGB pixels. Images are only decoded one by one, resizing and grayscale conversion
+    are done at once for all images of the same size.
+    :return: uint8 grayscale array of shape (N, imsize, imsize).
+    """
+    images = [decode_image(image_path) for image_path in image_paths]
+    glyphs = np.zeros((len(images), imsize, imsize), dtype=np.uint8)
+    sizes = {}
+    for position, image in enumerate(images):
+        sizes.setdefault(image.shape, []).append(position)
+    for positions in sizes.values():
+        resized = np.ascontiguousarray(resize_batch(np.stack([images[position] for position in positions]), imsize))
+        # all images as one image of rows of pixels, COLOR_BGR2GRAY of RGB pixels is COLOR_RGB2GRAY of BGR pixels
+        gray = cv2.cvtColor(resized.reshape((-1, imsize, 3)), cv2.COLOR_RGB2GRAY)
+        glyphs[positions] = gray.reshape((len(positions), imsize, imsize))
+    return glyphs
+
+
+def iter_image_batches(image_paths, imsize, batch_size, executor=None, prefetch=2):
+    """
+    Load and preprocess images batch by batch (see load_image_batch) on the executor, at most prefetch batches
+    are loaded ahead while the current one is classified.
+    :param executor: ThreadPoolExecutor, batches are loaded when they are needed if None.
+    :return: Generator of (image paths, uint8 array of shape (len(image paths), imsize, imsize)) in the order of images.
+    """
+    batches = [image_paths[start:start + batch_size] for start in range(0, len(image_paths), batch_size)]
+    if executor is None:
+        for batch in batches:
+            yield batch, load_image_batch(batch, imsize)
+        return
+
+    pending = deque()
+    for batch in batches:
+        pending.append((batch, executor.submit(load_image_batch, batch, imsize)))
+        if len(pending) > prefetch:
+            batch, future = pending.popleft()
+            yield batch, future.result()
+    while pending:
+        batch, future = pending.popleft()
+        yield batch, future.result()
+
+
+def use_draw_tool():
+    # draw.py and glyph_archive.py are scripts of the sibling tool, they are imported only when needed
+    if DRAW_DIR not in sys.path:
+        sys.path.append(DRAW_DIR)
+
+
+def extract_polygon_glyphs(polygons_path, image_path, imsize, dump_dir=None):
+    """
+    Extract glyphs of polygons in YOLO format straight into memory, without saving and reading PNG files.
+    :param dump_dir: Also save glyphs as polygon_{index}.png to this directory.
+    :return: List of glyph names (polygon_{index}.png) and uint8 array of shape (N, imsize, imsize).
+    """
+    use_draw_tool()
+    from draw import extract_glyph_arrays
+    indices, glyphs = extract_glyph_arrays(polygons_path, image_path, imsize, dump_dir=dump_dir)
+    return [f"polygon_{index}.png" for index in indices], glyphs
+
+
+class GlyphClassifier:
+    """
+    Keras glyph classifier loaded once and kept warm for any number of predictions.
+    TensorFlow is imported only when the classifier is created, importing this module is cheap.
+    """
+
+    def __init__(self, architecture, weights, classes, batch_size=64):
+        """
+        :param architecture: Path to model architecture in .json format.
+        :param weights: Path to model weights in .h5 format.
+        :param classes: Path to dictionary containing classes in alphabetical order.
+        :param batch_size: Number of glyphs classified by one call of the model.
+        """
+        import tensorflow as tf
+        from tensorflow.keras.models import model_from_json
+
+        # Only allocates a subset of the available GPU Memory and take more as needed.
+        # Prevents "Failed to get convolution algorithm" error on Elementary OS Juno.
+        for gpu in tf.config.list_physical_devices('GPU'):
+            try:
+                tf.config.experimental.set_memory_growth(gpu, True)
+            except RuntimeError:
+                # GPU was already initialized by an earlier model of this process
+                pass
+
+        with open(architecture, 'r') as json_file:
+            self.model = model_from_json(json_file.read())
+        self.model.load_weights(weights)
+        self.class_names = load_class_names(classes)
+        # identifies the model in caches of its predictions
+        self.fingerprint = files_digest(architecture, weights, classes)
+        self.batch_size = batch_size
+        _, height, width, channels = self.model.input_shape
+        self.imsize = height
+        # one traced graph for every batch size, calling it has none of the per call setup of predict()
+        self._predict = tf.function(lambda batch: self.model(batch, training=False),
+                                    input_signature=[tf.TensorSpec((None, height, width, channels), tf.float32)])
+
+    def warm_up(self):
+        """
+        Trace the graph now, so the first real batch is not slowed down by it.
+        """
+        self.predict_batch(np.zeros((1, self.imsize, self.imsize), dtype=np.uint8))
+
+    def predict_probabilities(self, batch):
+        """
+        :param batch: float32 array of shape (N, H, W, 1) scaled to 0-1.
+        :return: Array of class probabilities of shape (N, number of classes).
+        """
+        return self._predict(batch).numpy()
+
+    def predict_batch_probabilities(self, glyphs):
+        """
+        Class probabilities of glyphs, one call of the model per batch_size glyphs.
+        :param glyphs: uint8 grayscale array of shape (N, H, W) (or list of (H, W) arrays) in the input size of the model.
+        :return: float32 array of shape (N, number of classes).
+        """
+        glyphs = np.asarray(glyphs, dtype=np.uint8)
+        if glyphs.ndim != 3 or glyphs.shape[1:] != (self.imsize, self.imsize):
+            raise ValueError(f"glyphs must have shape (N, {self.imsize}, {self.imsize}), got {glyphs.shape}")
+        probabilities = np.zeros((len(glyphs), len(self.class_names)), dtype=np.float32)
+        for start in range(0, len(glyphs), self.batch_size):
+            batch = glyphs[start:start + self.batch_size]
+            batch = batch.reshape((batch.shape[0], batch.shape[1], batch.shape[2], 1))
+            batch = batch.astype('float32') / 255
+            probabilities[start:start + len(batch)] = self.predict_probabilities(batch)
+        return probabilities
+
+    def class_predictions(self, probabilities):
+        """
+        :param probabilities: Array of class probabilities of shape (N, number of classes).
+        :return: List of (predicted class name, certainty).
+        """
+        predicted_class_idxs = np.argmax(probabilities, axis=1)
+        certainties = probabilities[np.arange(len(probabilities)), predicted_class_idxs]
+        return [(self.class_names[predicted_class_idx], certainty)
+                for predicted_class_idx, certainty in zip(predicted_class_idxs.tolist(), certainties.tolist())]
+
+    def predict_batch(self, glyphs):
+        """
+        Classify glyphs.
+        :param glyphs: uint8 grayscale array of shape (N, H, W) (or list of (H, W) arrays) in the input size of the model.
+        :return: List of (predicted class name, certainty).
+        """
+        return self.class_predictions(self.predict_batch_probabilities(glyphs))
+
+    def predict_dir(self, image_dir, prefetch=2):
+        """
+        Classify all images in the directory in the order of glyphs (polygon_2.png before polygon_10.png).
+        Next batches are decoded and preprocessed by prefetch threads while the current batch is classified.
+        :param prefetch: Number of batches loaded ahead, 0 loads every batch when it is needed.
+        :return: List of (image filename, predicted class name, certainty).
+        """
+        image_paths = [os.path.join(image_dir, image_file) for image_file in list_images(image_dir)]
+        executor = ThreadPoolExecutor(max_workers=prefetch) if prefetch > 0 else None
+        results = []
+        try:
+            for batch, glyphs in iter_image_batches(image_paths, self.imsize, self.batch_size, executor, prefetch):
+                results.extend((os.path.basename(image_path), predicted_class_name, certainty)
+                               for image_path, (predicted_class_name, certainty) in zip(batch, self.predict_batch(glyphs)))
+        finally:
+            if executor is not None:
+                executor.shutdown()
+        return results
+
+    def predict_polygons(self, polygons_path, image_path, dump_dir=None):
+        """
+        Classify glyphs of polygons in YOLO format extracted in memory.
+        :param dump_dir: Also save glyphs as polygon_{index}.png to this directory.
+        :return: List of (glyph name, predicted class name, certainty).
+        """
+        glyph_names, glyphs = extract_polygon_glyphs(polygons_path, image_path, self.imsize, dump_dir)
+        return [(glyph_name, predicted_class_name, certainty)
+                for glyph_name, (predicted_class_name, certainty) in zip(glyph_names, self.predict_batch(glyphs))]
+
+    def predict_archive(self, archive_path, inscriptions=None):
+        """
+        Classify glyphs of a glyph archive written by draw.py --archive, glyphs are read from the memory-mapped archive.
+        :param inscriptions: Ids of inscriptions to classify (default all).
+        :return: List of (inscription id, glyph name (polygon_{index}.png), predicted class name, certainty).
+        """
+        use_draw_tool()
+        from glyph_archive import GlyphArchive
+        archive = GlyphArchive(archive_path)
+        results = []
+        for inscription in inscriptions or archive.inscriptions():
+            glyphs, polygons = archive.inscription(inscription)
+            predictions = self.predict_batch(resize_batch(glyphs, self.imsize))
+            results.extend((inscription, f"polygon_{polygon}.png", predicted_class_name, certainty)
+                           for polygon, (predicted_class_name, certainty) in zip(polygons.tolist(), predictions))
+        return results
+
+
+class TFLiteGlyphClassifier(GlyphClassifier):
+    """
+    Glyph classifier exported by export_tflite.py, run by the TensorFlow Lite interpreter.
+    tflite_runtime is used when it is installed, it loads much faster and needs much less memory than TensorFlow.
+    Quantized (int8) inputs and outputs are converted, so probabilities are the same as of the Keras classifier.
+    """
+
+    def __init__(self, model, classes, batch_size=64, threads=None):
+        """
+        :param model: Path to model in .tflite format.
+        :param classes: Path to dictionary containing classes in alphabetical order.
+        :param threads: Number of threads of the interpreter (default chosen by TensorFlow Lite).
+        """
+        try:
+            from tflite_runtime.interpreter import Interpreter
+        except ImportError:
+            import tensorflow as tf
+            Interpreter = tf.lite.Interpreter
+
+        self.interpreter = Interpreter(model_path=model, num_threads=threads)
+        input_details = self.interpreter.get_input_details()[0]
+        output_details = self.interpreter.get_output_details()[0]
+        self._input_index = input_details['index']
+        self._input_dtype = input_details['dtype']
+        self._input_quantization = input_details['quantization']
+        self._output_index = output_details['index']
+        self._output_quantization = output_details['quantization']
+        self.class_names = load_class_names(classes)
+        self.fingerprint = files_digest(model, classes)
+        self.batch_size = batch_size
+        _, height, width, channels = input_details['shape']
+        self.imsize = int(height)
+        # tensors are allocated again only when the size of the batch changes
+        self._allocated_batch = None
+
+    def predict_probabilities(self, batch):
+        if len(batch) != self._allocated_batch:
+            self.interpreter.resize_tensor_input(self._input_index, [len(batch), self.imsize, self.imsize, 1])
+            self.interpreter.allocate_tensors()
+            self._allocated_batch = len(batch)
+        if self._input_dtype != np.float32:
+            scale, zero_point = self._input_quantization
+            limits = np.iinfo(self._input_dtype)
+            batch = np.clip(np.round(batch / scale + zero_point), limits.min, limits.max).astype(self._input_dtype)
+        self.interpreter.set_tensor(self._input_index, batch)
+        self.interpreter.invoke()
+        probabilities = self.interpreter.get_tensor(self._output_index)
+        if probabilities.dtype != np.float32:
+            scale, zero_point = self._output_quantization
+            probabilities = (probabilities.astype(np.float32) - zero_point) * scale
+        return probabilities
+
+
+class StandInClassifier(GlyphClassifier):
+    """
+    Deterministic classifier without TensorFlow and model files for local runs and load tests of the tools around it.
+    Probabilities are a softmax of a fixed random projection of the glyph pixels, so the same glyph
+    always gets the same class, but the classes have no meaning.
+    """
+
+    def __init__(self, classes, imsize=28, batch_size=64, seed=0):
+        """
+        :param classes: Path to dictionary containing classes in alphabetical order.
+        :param imsize: Input size of the simulated model.
+        """
+        self.class_names = load_class_names(classes)
+        self.batch_size = batch_size
+        self.imsize = imsize
+        self.fingerprint = f"stand-in-{seed}-{imsize}-{files_digest(classes)}"
+        self._weights = np.random.default_rng(seed).standard_normal((imsize * imsize, len(self.class_names)),
+                                                                    dtype=np.float32)
+
+    def predict_probabilities(self, batch):
+        logits = batch.reshape(len(batch), -1) @ self._weights
+        logits -= logits.max(axis=1, keepdims=True)
+        probabilities = np.exp(logits)
+        return probabilities / probabilities.sum(axis=1, keepdims=True)
@@ -1,75 +1,76 @@
-from tensorflow.keras.models import load_model
-from tensorflow.keras.models import model_from_json
-import numpy as np
-import cv2
-import tensorflow as tf
 import os
+import sys
+import time
 import argparse
-from PIL import Image
+from glyph_classifier import GlyphClassifier, TFLiteGlyphClassifier
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'Common'))
+from profiling import add_profile_arguments, create_profiler
 
-# Only allocates a subset of the available GPU Memory and take more as needed.
-# Prevents "Failed to get convolution algorithm" error on Elementary OS Juno.
-config = tf.compat.v1.ConfigProto()
-config.gpu_options.allow_growth = True
-sess = tf.compat.v1.Session(config=config)
 
-# Argument parser
-ap = argparse.ArgumentParser()
-ap.add_argument("--imdir", "-d", type=str, required=True, help="Path to directory containing images to predict.")
-ap.add_argument("--classes", "-c", type=str, required=True, help="Path to dictionary containing classes in alphabetical order.")
-ap.add_argument("--imsize", "-s", type=int, default=28, help="Size of input images.")
-ap.add_argument("--archpath", "-a", type=str, required=True, default="./model.json", help="Path to model architecture in .json format.")
-ap.add_argument("--weipath", "-w", type=str, required=True, default="./model.h5", help="Path to model weights in .h5 format.")
-args = vars(ap.parse_args())
+def main():
+    # Argument parser
+    ap = argparse.ArgumentParser()
+    source = ap.add_mutually_exclusive_group(required=True)
+    source.add_argument("--imdir", "-d", type=str, help="Path to directory containing images to predict.")
+    source.add_argument("--polygons", "-p", type=str,
+                        help="Path to polygons in YOLO format, glyphs are extracted in memory (requires --image).")
+    source.add_argument("--archive", type=str, help="Path to glyph archive written by draw.py --archive.")
+    ap.add_argument("--image", "-i", type=str, help="Path to the original image of --polygons.")
+    ap.add_argument("--dump-dir", type=str, help="With --polygons, also save extracted glyphs as PNG files to this directory.")
+    ap.add_argument("--classes", "-c", type=str, required=True, help="Path to dictionary containing classes in alphabetical order.")
+    ap.add_argument("--imsize", "-s", type=int, help="Size of input images, must match the model (default input size of the model).")
+    ap.add_argument("--archpath", "-a", type=str, help="Path to model architecture in .json format.")
+    ap.add_argument("--weipath", "-w", type=str, help="Path to model weights in .h5 format.")
+    ap.add_argument("--tflite", "-t", type=str,
+                    help="Path to model in .tflite format exported by export_tflite.py, used instead of --archpath and --weipath.")
+    ap.add_argument("--batch-size", "-b", type=int, default=64, help="Number of glyphs classified at once.")
+    ap.add_argument("--prefetch", type=int, default=2,
+                    help="With --imdir, number of batches decoded and preprocessed by background threads while"
+                         " the current batch is classified (0 loads every batch when it is needed).")
+    add_profile_arguments(ap)
+    parsed = ap.parse_args()
+    args = vars(parsed)
+    if args["polygons"] and not args["image"]:
+        ap.error("--polygons requires --image")
+    if not args["tflite"] and not (args["archpath"] and args["weipath"]):
+        ap.error("--archpath and --weipath are required without --tflite")
 
-# Load the model architecture and weights
-architecture = args["archpath"]
-weights = args["weipath"]
-json_file = open(architecture, 'r')
-loaded_model_json = json_file.read()
-json_file.close()
-loaded_model = model_from_json(loaded_model_json)
-loaded_model.load_weights(weights)
+    with create_profiler(parsed, 'predict_polygons') as profiler:
+        with profiler.stage('load model'):
+            if args["tflite"]:
+                classifier = TFLiteGlyphClassifier(args["tflite"], args["classes"], args["batch_size"])
+            else:
+                classifier = GlyphClassifier(args["archpath"], args["weipath"], args["classes"], args["batch_size"])
+        if args["imsize"] and args["imsize"] != classifier.imsize:
+            ap.error(f"--imsize {args['imsize']} does not match the input size {classifier.imsize} of the model")
 
-# Open Class labels dictionary
-classes_dict = eval(open(args["classes"], 'r').read())
-class_names = list(classes_dict.values())
+        start = time.perf_counter()
+        # glyphs are decoded or extracted while they are classified, so both are in this stage
+        with profiler.stage('classify') as counts:
+            if args["archive"]:
+                predictions = classifier.predict_archive(args["archive"])
+            elif args["polygons"]:
+                predictions = classifier.predict_polygons(args["polygons"], args["image"], args["dump_dir"])
+            else:
+                predictions = classifier.predict_dir(args["imdir"], args["prefetch"])
+            counts["glyphs"] = len(predictions)
+        elapsed = time.perf_counter() - start
 
-# Get a list of image files in the specified directory
-image_dir = args["imdir"]
-image_files = [f for f in os.listdir(image_dir) if os.path.isfile(os.path.join(image_dir, f))]
-
-# Counter for misclassified files
-misclassified_files = 0
-
-# Iterate through the image files and make predictions
-for image_file in image_files:
-    # Load and preprocess the image
-    img_path = os.path.join(image_dir, image_file)
-    img = Image.open(img_path)
-    img = img.resize((args["imsize"], args["imsize"]), Image.BILINEAR)
-    img = np.array(img)
-    img = cv2.cvtColor(img, cv2.COLOR_BGR2GRAY)
-    img = np.array(img)
-    img = img.reshape((1, img.shape[0], img.shape[1], 1))
-    img = img.astype('float32') / 255
-
-    # Make predictions on the image
-    preds = loaded_model.predict(img)
-    predicted_class_idx = np.argmax(preds)
-    predicted_class_name = class_names[predicted_class_idx]
-    
-    # Extract the folder name from the image file's parent directory
-    folder_name = os.path.basename(os.path.dirname(img_path))
-
-    # Check if the folder name matches the predicted class name
-    #if folder_name != predicted_class_name:
-    #    misclassified_files += 1
+    # Print the results for each image
+    inscription = None
+    for prediction in predictions:
+        if args["archive"]:
+            # glyphs of more inscriptions, every inscription starts with its id
+            if prediction[0] != inscription:
+                inscription = prediction[0]
+                print(inscription)
+            prediction = prediction[1:]
+        image_file, predicted_class_name, certainty = prediction
+        #print(f"Image: {image_file}, Predicted Class: {predicted_class_name}, Certainty: {certainty:.4f}")
+        print({image_file}, " : " , {predicted_class_name})
+    print(f"Classified {len(predictions)} glyphs in {elapsed:.2f} s ({len(predictions) / max(elapsed, 1e-9):.0f} glyphs/s)"
+          f" with batch size {args['batch_size']}", file=sys.stderr)
 
-    certainty = preds[0][predicted_class_idx]
 
-    # Print the results for each image
-    #print(f"Image: {image_file}, Predicted Class: {predicted_class_name}, Folder Name: {folder_name}, Certainty: {certainty:.4f}")
-    print({image_file}, " : " , {predicted_class_name})
-# Print the count of misclassified files
-#print(f"Total misclassified files: {misclassified_files}")
\ No newline at end of file
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,80 @@
+import glob
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+# class names of the worker process by class list filename, read by the first task of every worker
+_class_names = {}
+
+
+def find_input_files(path, pattern, output_suffix):
+    """
+    Input files of batch mode.
+    :param path: Directory or glob pattern.
+    :param pattern: Pattern of input files used when path is a directory.
+    :param output_suffix: Files ending with this suffix are outputs of previous runs and are skipped.
+    :return: Sorted list of input filenames.
+    """
+    if os.path.isdir(path):
+        path = os.path.join(path, pattern)
+    return sorted(filename for filename in glob.glob(path)
+                  if os.path.isfile(filename) and not filename.endswith(output_suffix))
+
+
+def worker_class_names(read_class_names, class_list_filename):
+    # ProcessPoolExecutor initializer needs Python 3.7, so the class list is read by the first task instead
+    if class_list_filename not in _class_names:
+        _class_names[class_list_filename] = read_class_names(class_list_filename)
+    return _class_names[class_list_filename]
+
+
+def sort_task(sort_file, read_class_names, class_list_filename, input_filename, strategy, plot):
+    """
+    Sort one file in a worker process, the figure is saved next to the sorted file.
+    :return: Tuple (input filename, output filename, polygons, rows, transcript, seconds, error).
+    """
+    start = time.perf_counter()
+    try:
+        class_names = worker_class_names(read_class_names, class_list_filename)
+        output_filename, sorted_polygons, rows = sort_file(input_filename, strategy)
+        if plot:
+            from visualize import generate_figure_filename, visualize_sorted_polygons
+            visualize_sorted_polygons(sorted_polygons, class_names, generate_figure_filename(output_filename))
+        transcript = ' '.join(class_names[class_index] for class_index in sorted_polygons.class_ids.tolist())
+        return input_filename, output_filename, len(sorted_polygons), rows, transcript, time.perf_counter() - start, None
+    except Exception as error:
+        return input_filename, None, 0, 0, '', time.perf_counter() - start, f"{type(error).__name__}: {error}"
+
+
+def run_batch(input_filenames, sort_file, read_class_names, class_list_filename, strategy='threshold', workers=None,
+              plot=False):
+    """
+    Sort many files on a process pool, outputs are written next to the inputs.
+    :param input_filenames: List of input filenames.
+    :param sort_file: Function (input filename, strategy) -> (output filename, sorted polygons, number of rows).
+    :param read_class_names: Function reading class list, called once in every worker by its first task.
+    :param class_list_filename: Path to class list.
+    :param strategy: Name of row clustering strategy.
+    :param workers: Number of worker processes, defaults to number of CPUs.
+    :param plot: Save visualization of every file, matplotlib is imported only by workers which plot.
+    :return: List of results of sort_task.
+    """
+    start = time.perf_counter()
+    with ProcessPoolExecutor(max_workers=workers) as executor:
+        futures = [executor.submit(sort_task, sort_file, read_class_names, class_list_filename, input_filename, strategy, plot)
+                   for input_filename in input_filenames]
+        results = [future.result() for future in futures]
+    elapsed = time.perf_counter() - start
+
+    print(f"{'file':50} {'polygons':>8} {'rows':>5} {'time [ms]':>10}")
+    for input_filename, output_filename, polygons, rows, transcript, seconds, error in results:
+        if error:
+            print(f"{os.path.basename(input_filename):50} FAILED {error}")
+            continue
+        print(f"{os.path.basename(input_filename):50} {polygons:8d} {rows:5d} {seconds * 1000:10.1f}")
+        print(f"    {transcript}")
+    failed = sum(1 for result in results if result[-1])
+    total_polygons = sum(result[2] for result in results)
+    print(f"Sorted {len(results) - failed} files ({total_polygons} polygons) in {elapsed:.2f} s"
+          f" with {workers or os.cpu_count()} workers, {failed} failed.")
+    return results
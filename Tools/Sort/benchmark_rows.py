@@ -0,0 +1,85 @@
+import argparse
+import glob
+import json
+import os
+import time
+import numpy as np
+from polygon_store import PolygonStore
+from row_clustering import SORT_STRATEGIES, cluster_rows
+
+DEFAULT_TEST_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', '..', 'Test')
+
+
+def find_pages(test_dir):
+    """
+    Pairs of unsorted predictions and their reference sorted output from the Test directory.
+    :return: List of (name, PolygonStore, reference lines).
+    """
+    pages = []
+    for input_filename in sorted(glob.glob(os.path.join(test_dir, '*', '*-yolo-*class.txt'))):
+        base_filename = os.path.splitext(input_filename)[0]
+        for reference_filename in glob.glob(base_filename + '[-_]sorted.txt'):
+            with open(reference_filename, 'r') as file:
+                reference = [line.strip() for line in file if line.strip()]
+            pages.append((os.path.basename(input_filename), PolygonStore.from_yolo_file(input_filename), reference))
+    for input_filename in sorted(glob.glob(os.path.join(test_dir, '*', '*-roboflow-*class.json'))):
+        reference_filename = os.path.splitext(input_filename)[0] + '-sorted.json'
+        if not os.path.exists(reference_filename):
+            continue
+        with open(input_filename, 'r') as json_file:
+            polygons = PolygonStore.from_roboflow_json(json.load(json_file))
+        with open(reference_filename, 'r') as json_file:
+            reference = PolygonStore.from_roboflow_json(json.load(json_file))
+        pages.append((os.path.basename(input_filename), polygons, [line.strip() for line in reference.to_yolo_lines()]))
+    return pages
+
+
+def tile_page(polygons, count):
+    """
+    Synthetic large page made of count copies of the page stacked below each other.
+    """
+    if count <= 1:
+        return polygons
+    geometry = polygons.geometry()
+    page_height = geometry.bottom.max() - geometry.top.min() + np.average(geometry.height)
+    shifts = np.repeat(np.arange(count) * page_height, len(polygons.vertices))
+    vertices = np.tile(polygons.vertices, (count, 1))
+    vertices[:, 1] += shifts
+    offsets = np.concatenate([[0], np.tile(polygons.vertex_counts, count).cumsum()])
+    return PolygonStore(vertices, offsets, np.tile(polygons.class_ids, count))
+
+
+def order_agreement(polygons, rows, reference):
+    """
+    Fraction of polygons which are on the same position as in the reference sorted output.
+    """
+    lines = [line.strip() for line in polygons.take(np.concatenate(rows)).to_yolo_lines()]
+    return sum(line == reference_line for line, reference_line in zip(lines, reference)) / max(len(reference), 1)
+
+
+def benchmark(pages, strategies, repeats, tile):
+    print(f"{'page':45} {'strategy':10} {'rows':>5} {'agreement':>9} {'polygons/s':>12}")
+    for name, polygons, reference in pages:
+        for strategy in strategies:
+            # reference files keep the last row top to bottom, compare only the row grouping
+            rows = cluster_rows(polygons, strategy, sort_last_row=False)
+            agreement = order_agreement(polygons, rows, reference)
+            page = tile_page(polygons, tile)
+            start = time.perf_counter()
+            for _ in range(repeats):
+                # fresh store so the cached geometry is part of the measured time
+                cluster_rows(PolygonStore(page.vertices, page.offsets, page.class_ids), strategy)
+            elapsed = time.perf_counter() - start
+            print(f"{name:45} {strategy:10} {len(rows):5d} {agreement:9.1%} {len(page) * repeats / elapsed:12.0f}")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Benchmark row clustering strategies on the Test inscriptions.")
+    parser.add_argument("-d", "--test-dir", default=DEFAULT_TEST_DIR, help="Directory with test inscriptions")
+    parser.add_argument("-s", "--strategy", action="append", choices=SORT_STRATEGIES,
+                        help="Strategy to benchmark, can be repeated (default all)")
+    parser.add_argument("-r", "--repeats", type=int, default=20, help="Number of timed runs per page")
+    parser.add_argument("-t", "--tile", type=int, default=1,
+                        help="Stack the page this many times to measure throughput on large pages")
+    args = parser.parse_args()
+    benchmark(find_pages(args.test_dir), args.strategy or SORT_STRATEGIES, args.repeats, args.tile)
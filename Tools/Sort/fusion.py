@@ -0,0 +1,215 @@
+import argparse
+import json
+import os
+import time
+import numpy as np
+from PIL import Image
+from polygon_store import PolygonStore
+
+FUSION_PREFERENCES = ['yolo', 'roboflow']
+# fewer matched glyphs usually mean that the predictions are in different coordinate frames
+MIN_MATCH_RATE = 0.5
+
+
+def grid_cells(bboxes, cell_size):
+    """
+    Cells of a uniform grid covered by every box.
+    :return: Keys of cells and index of the box of every key.
+    """
+    first = np.floor(bboxes[:, :2] / cell_size).astype(np.int64)
+    last = np.floor(bboxes[:, 2:] / cell_size).astype(np.int64)
+    columns = last[:, 0] - first[:, 0] + 1
+    counts = columns * (last[:, 1] - first[:, 1] + 1)
+    boxes = np.repeat(np.arange(len(bboxes)), counts)
+    # position of every cell within its box
+    positions = np.arange(counts.sum()) - np.repeat(np.cumsum(counts) - counts, counts)
+    x = first[boxes, 0] + positions % columns[boxes]
+    y = first[boxes, 1] + positions // columns[boxes]
+    return (y << 32) + x, boxes
+
+
+def bbox_iou(boxes_a, boxes_b):
+    """
+    IoU of pairs of boxes (left, top, right, bottom), row by row.
+    """
+    width = np.minimum(boxes_a[:, 2], boxes_b[:, 2]) - np.maximum(boxes_a[:, 0], boxes_b[:, 0])
+    height = np.minimum(boxes_a[:, 3], boxes_b[:, 3]) - np.maximum(boxes_a[:, 1], boxes_b[:, 1])
+    intersection = np.clip(width, 0, None) * np.clip(height, 0, None)
+    area_a = (boxes_a[:, 2] - boxes_a[:, 0]) * (boxes_a[:, 3] - boxes_a[:, 1])
+    area_b = (boxes_b[:, 2] - boxes_b[:, 0]) * (boxes_b[:, 3] - boxes_b[:, 1])
+    union = area_a + area_b - intersection
+    return np.divide(intersection, union, out=np.zeros_like(intersection), where=union > 0)
+
+
+def overlapping_pairs(bboxes_a, bboxes_b, min_iou=0.5):
+    """
+    Pairs of boxes of two sets with IoU at least min_iou. Boxes are put into cells of a uniform grid
+    of the median box size and only boxes sharing a cell are compared, overlapping boxes always share one,
+    so the number of compared pairs grows with the number of boxes, not with its square.
+    :return: Indices of boxes in set a, indices of boxes in set b and their IoU.
+    """
+    if not len(bboxes_a) or not len(bboxes_b):
+        return np.zeros(0, dtype=np.int64), np.zeros(0, dtype=np.int64), np.zeros(0)
+    sizes = np.concatenate([bboxes_a[:, 2:] - bboxes_a[:, :2], bboxes_b[:, 2:] - bboxes_b[:, :2]]).ravel()
+    origin = np.minimum(bboxes_a[:, :2].min(axis=0), bboxes_b[:, :2].min(axis=0))
+    extent = max(bboxes_a[:, 2:].max(), bboxes_b[:, 2:].max()) - origin.min()
+    # the grid has at most 2^16 cells on a side, so keys of cells (y << 32) + x never overflow
+    cell_size = max(np.median(sizes), extent / 2 ** 16, 1e-9)
+    keys_a, boxes_a = grid_cells(np.hstack([bboxes_a[:, :2] - origin, bboxes_a[:, 2:] - origin]), cell_size)
+    keys_b, boxes_b = grid_cells(np.hstack([bboxes_b[:, :2] - origin, bboxes_b[:, 2:] - origin]), cell_size)
+
+    # join cells of both sets on their keys
+    order = np.argsort(keys_b, kind='stable')
+    keys_b, boxes_b = keys_b[order], boxes_b[order]
+    starts = np.searchsorted(keys_b, keys_a, 'left')
+    counts = np.searchsorted(keys_b, keys_a, 'right') - starts
+    pairs_a = np.repeat(boxes_a, counts)
+    pairs_b = boxes_b[np.repeat(starts, counts) + np.arange(counts.sum()) - np.repeat(np.cumsum(counts) - counts, counts)]
+    # boxes sharing more cells are paired more times
+    pairs = np.unique(pairs_a * len(bboxes_b) + pairs_b)
+    pairs_a, pairs_b = pairs // len(bboxes_b), pairs % len(bboxes_b)
+
+    iou = bbox_iou(bboxes_a[pairs_a], bboxes_b[pairs_b])
+    keep = iou >= min_iou
+    return pairs_a[keep], pairs_b[keep], iou[keep]
+
+
+def match_pairs(pairs_a, pairs_b, iou):
+    """
+    One to one matching of overlapping boxes, pairs with higher IoU are matched first.
+    :return: Matched indices of set a and of set b.
+    """
+    matched_a, matched_b = [], []
+    used_a, used_b = set(), set()
+    for position in np.argsort(-iou, kind='stable').tolist():
+        a, b = int(pairs_a[position]), int(pairs_b[position])
+        if a not in used_a and b not in used_b:
+            used_a.add(a)
+            used_b.add(b)
+            matched_a.append(a)
+            matched_b.append(b)
+    return np.array(matched_a, dtype=np.int64), np.array(matched_b, dtype=np.int64)
+
+
+def fuse_polygons(yolo_polygons, roboflow_polygons, image_size, min_iou=0.5, prefer='yolo', min_votes=1,
+                  min_match_rate=MIN_MATCH_RATE):
+    """
+    Fuse predictions of both segmentation models of one inscription into one set without duplicates.
+    Glyphs found by both models are matched by IoU of their bounding boxes, every matched glyph is kept once
+    with the polygon of the preferred model.
+    :param yolo_polygons: PolygonStore in relative coordinates.
+    :param roboflow_polygons: PolygonStore in pixels, only kept polygons are converted to relative coordinates
+        (see PolygonStore.to_relative), boxes are enough for matching.
+    :param image_size: Size (width, height) of the image Roboflow predicted on (see roboflow_image_size).
+    :param prefer: Model whose polygon is kept for glyphs found by both, "yolo" or "roboflow".
+    :param min_votes: 1 keeps glyphs found by any model, 2 only glyphs found by both.
+    :param min_match_rate: Minimal share of glyphs of the smaller set matched, ValueError is raised below it,
+        because the union would contain most glyphs twice (e.g. Roboflow predicted on a resized image of unknown size).
+        0 disables the check.
+    :return: PolygonStore in relative coordinates (matched glyphs first, then glyphs found only by YOLO
+        and only by Roboflow) and dictionary with number of matched, YOLO only and Roboflow only glyphs.
+    """
+    if prefer not in FUSION_PREFERENCES:
+        raise ValueError(f"unknown preferred model {prefer}")
+    roboflow_bboxes = roboflow_polygons.geometry().bboxes / np.tile(np.asarray(image_size, dtype=np.float64), 2)
+    pairs_yolo, pairs_roboflow, iou = overlapping_pairs(yolo_polygons.geometry().bboxes, roboflow_bboxes, min_iou)
+    matched_yolo, matched_roboflow = match_pairs(pairs_yolo, pairs_roboflow, iou)
+    only_yolo = np.setdiff1d(np.arange(len(yolo_polygons)), matched_yolo)
+    only_roboflow = np.setdiff1d(np.arange(len(roboflow_polygons)), matched_roboflow)
+    expected = min(len(yolo_polygons), len(roboflow_polygons))
+    if expected and len(matched_yolo) < min_match_rate * expected:
+        raise ValueError(f"only {len(matched_yolo)} of {expected} glyphs of YOLO and Roboflow predictions matched,"
+                         f" the predictions are probably in different coordinate frames, pass the size of the image"
+                         f" Roboflow predicted on (--roboflow-size)")
+
+    if prefer == 'yolo':
+        stores = [yolo_polygons.take(matched_yolo)]
+    else:
+        stores = [roboflow_polygons.take(matched_roboflow).to_relative(image_size)]
+    if min_votes <= 1:
+        stores += [yolo_polygons.take(only_yolo), roboflow_polygons.take(only_roboflow).to_relative(image_size)]
+    counts = {"matched": len(matched_yolo), "yolo only": len(only_yolo), "roboflow only": len(only_roboflow)}
+    return PolygonStore.concatenate(stores), counts
+
+
+def parse_image_size(text):
+    """
+    :param text: Size as WIDTHxHEIGHT, e.g. 691x922.
+    :return: Size (width, height).
+    """
+    try:
+        width, height = (float(value) for value in text.lower().split('x'))
+    except ValueError:
+        raise ValueError(f"image size must be WIDTHxHEIGHT, got {text!r}")
+    if width <= 0 or height <= 0:
+        raise ValueError(f"image size must be positive, got {text!r}")
+    return width, height
+
+
+def roboflow_image_size(json_data, image_size, roboflow_size=None):
+    """
+    Size of the image Roboflow predicted on, Roboflow API responses contain it ("image": {"width", "height"}),
+    the image may have been resized before the prediction.
+    :param image_size: Size (width, height) of the original image, used when the response does not contain it.
+    :param roboflow_size: Size (width, height) given explicitly, used before the size in the response.
+    """
+    if roboflow_size is not None:
+        return roboflow_size
+    image = json_data.get("image") if isinstance(json_data, dict) else None
+    if image and "width" in image and "height" in image:
+        return float(image["width"]), float(image["height"])
+    return image_size
+
+
+def fuse_files(yolo_filename, roboflow_filename, image_filename, min_iou=0.5, prefer='yolo', min_votes=1,
+               roboflow_size=None, min_match_rate=MIN_MATCH_RATE):
+    """
+    Fuse predictions files of one inscription, the size of the image is needed to convert Roboflow pixels.
+    :return: Fused PolygonStore in relative coordinates and counts, see fuse_polygons.
+    """
+    yolo_polygons = PolygonStore.from_yolo_file(yolo_filename)
+    with open(roboflow_filename, 'r') as json_file:
+        json_data = json.load(json_file)
+    roboflow_polygons = PolygonStore.from_roboflow_json(json_data)
+    # Only the header of the image is read to get its size
+    with Image.open(image_filename) as image:
+        image_size = roboflow_image_size(json_data, image.size, roboflow_size)
+    return fuse_polygons(yolo_polygons, roboflow_polygons, image_size, min_iou, prefer, min_votes, min_match_rate)
+
+
+def generate_output_filename(yolo_filename):
+    base_filename, ext = os.path.splitext(yolo_filename)
+    return f"{base_filename}-fused{ext}"
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Fuse YOLO and Roboflow predictions of one inscription into one set"
+                                                 " of polygons in YOLO format, which can be sorted by sort.py.")
+    parser.add_argument("yolo", help="YOLO predictions (.txt)")
+    parser.add_argument("roboflow", help="Roboflow predictions (.json)")
+    parser.add_argument("image", help="Original image, its size converts Roboflow pixels to relative coordinates")
+    parser.add_argument("-o", "--output", help="Output filename (default <yolo predictions>-fused.txt)")
+    parser.add_argument("--iou", type=float, default=0.5, help="Minimal IoU of bounding boxes of one glyph")
+    parser.add_argument("--prefer", choices=FUSION_PREFERENCES, default="yolo",
+                        help="Model whose polygon is kept for glyphs found by both models")
+    parser.add_argument("--min-votes", type=int, choices=[1, 2], default=1,
+                        help="1 keeps glyphs found by any model, 2 only glyphs found by both")
+    parser.add_argument("--roboflow-size", type=parse_image_size,
+                        help="Size WIDTHxHEIGHT of the image Roboflow predicted on, when the predictions do not contain it"
+                             " and the image was resized (default size of the image)")
+    parser.add_argument("--min-match-rate", type=float, default=MIN_MATCH_RATE,
+                        help="Fail when fewer glyphs of the smaller set are matched, 0 disables the check")
+    args = parser.parse_args()
+
+    start = time.perf_counter()
+    try:
+        polygons, counts = fuse_files(args.yolo, args.roboflow, args.image, args.iou, args.prefer, args.min_votes,
+                                      args.roboflow_size, args.min_match_rate)
+    except ValueError as error:
+        parser.exit(1, f"{error}\n")
+    elapsed = time.perf_counter() - start
+    output_filename = args.output or generate_output_filename(args.yolo)
+    with open(output_filename, 'w') as file:
+        file.writelines(polygons.to_yolo_lines())
+    print(f"{len(polygons)} polygons ({', '.join(f'{count} {name}' for name, count in counts.items())})"
+          f" fused in {elapsed * 1000:.1f} ms and saved to {output_filename}")
@@ -0,0 +1,122 @@
+import numpy as np
+
+
+class GridIndex:
+    """
+    Uniform grid over points for neighbour queries in near-linear time.
+    Points are sorted by their cell, so members of any cell are one slice of the sorted order.
+    """
+
+    def __init__(self, x, y, cell_size):
+        self.cell_size = cell_size
+        self.cell_x = np.floor((x - x.min()) / cell_size).astype(np.int64) + 1
+        self.cell_y = np.floor((y - y.min()) / cell_size).astype(np.int64) + 1
+        # one free column and row on each side, so neighbouring cell keys never collide
+        self.rows_count = int(self.cell_y.max()) + 2
+        keys = self.cell_x * self.rows_count + self.cell_y
+        self.order = np.argsort(keys, kind='stable')
+        self.sorted_keys = keys[self.order]
+
+    def candidate_pairs(self, cell_offsets):
+        """
+        All pairs (point, other point) where the other point lies in one of cells shifted by cell_offsets.
+        :param cell_offsets: List of (dx, dy) cell offsets.
+        :return: Arrays of point indices and other point indices.
+        """
+        sources = []
+        targets = []
+        for offset_x, offset_y in cell_offsets:
+            keys = (self.cell_x + offset_x) * self.rows_count + (self.cell_y + offset_y)
+            starts = np.searchsorted(self.sorted_keys, keys, side='left')
+            ends = np.searchsorted(self.sorted_keys, keys, side='right')
+            counts = ends - starts
+            # expand every [start, end) range into positions of the sorted order
+            source = np.repeat(np.arange(len(keys)), counts)
+            position = np.arange(counts.sum()) - np.repeat(np.cumsum(counts) - counts, counts) + np.repeat(starts, counts)
+            sources.append(source)
+            targets.append(self.order[position])
+        return np.concatenate(sources), np.concatenate(targets)
+
+
+def link_neighbours(sources, targets, costs, count):
+    """
+    Link every polygon to at most one left neighbour and every neighbour to at most one polygon.
+    In each round every polygon proposes its cheapest free neighbour and every neighbour accepts
+    the cheapest proposal, the globally cheapest link is always accepted, so rounds terminate.
+    :return: Array with index of left neighbour of each polygon, -1 for the line end.
+    """
+    next_polygon = np.full(count, -1, dtype=np.int64)
+    has_previous = np.zeros(count, dtype=bool)
+    while len(sources):
+        order = np.lexsort((costs, sources))
+        first = np.ones(len(order), dtype=bool)
+        first[1:] = sources[order][1:] != sources[order][:-1]
+        proposals = order[first]
+        order = proposals[np.lexsort((costs[proposals], targets[proposals]))]
+        first = np.ones(len(order), dtype=bool)
+        first[1:] = targets[order][1:] != targets[order][:-1]
+        accepted = order[first]
+        next_polygon[sources[accepted]] = targets[accepted]
+        has_previous[targets[accepted]] = True
+        free = (next_polygon[sources] < 0) & ~has_previous[targets]
+        sources, targets, costs = sources[free], targets[free], costs[free]
+    return next_polygon, has_previous
+
+
+def trace_lines(polygons, max_gap=2.5, tolerance=0.5, max_slope=0.6, vertical_weight=2.0):
+    """
+    Sort all polygons in list of text lines by linking every polygon to its left neighbour.
+    Lines may be skewed or curved, the neighbour only has to be in a cone left of the polygon.
+    Lines are sorted from right to left, lines are ordered top to bottom by their average center y.
+    :param polygons: PolygonStore with all unsorted polygons.
+    :param max_gap: Maximal horizontal distance of neighbouring centers in average polygon widths.
+    :param tolerance: Maximal vertical distance of neighbouring centers in average polygon heights.
+    :param max_slope: Maximal slope of the line, vertical distance allowed above tolerance per horizontal distance.
+    :param vertical_weight: Cost of vertical distance relative to horizontal distance (both in average sizes).
+    :return: List of lines with indices of sorted polygons.
+    """
+    count = len(polygons)
+    if count == 0:
+        return []
+    geometry = polygons.geometry()
+    center_x, center_y = geometry.center_x, geometry.center_y
+    avg_width = max(np.average(geometry.width), np.finfo(np.float64).tiny)
+    avg_height = max(np.average(geometry.height), np.finfo(np.float64).tiny)
+    reach_x = max_gap * avg_width
+    reach_y = tolerance * avg_height + max_slope * reach_x
+
+    # neighbour is left of the polygon within one cell, so the own and left cell columns are enough
+    index = GridIndex(center_x, center_y, max(reach_x, reach_y))
+    sources, targets = index.candidate_pairs([(dx, dy) for dx in (-1, 0) for dy in (-1, 0, 1)])
+    # links go only to polygons with lower rank along x, so lines never contain a cycle
+    # and polygons detected twice at the same x are still linked together
+    rank_x = np.empty(count, dtype=np.int64)
+    rank_x[np.argsort(center_x, kind='stable')] = np.arange(count)
+    dx = center_x[sources] - center_x[targets]
+    dy = np.abs(center_y[targets] - center_y[sources])
+    in_cone = (rank_x[targets] < rank_x[sources]) & (dx <= reach_x) & (dy <= tolerance * avg_height + max_slope * dx)
+    sources, targets, dx, dy = sources[in_cone], targets[in_cone], dx[in_cone], dy[in_cone]
+    costs = dx / avg_width + vertical_weight * dy / avg_height
+    next_polygon, has_previous = link_neighbours(sources, targets, costs, count)
+
+    # walk every line from its rightmost polygon
+    next_polygon = next_polygon.tolist()
+    line_labels = np.empty(count, dtype=np.int64)
+    line_count = 0
+    for polygon in np.flatnonzero(~has_previous).tolist():
+        line = []
+        while polygon >= 0:
+            line.append(polygon)
+            polygon = next_polygon[polygon]
+        line_labels[line] = line_count
+        line_count += 1
+
+    # fragments of one line split by a gap wider than max_gap have nearly the same average y
+    lines_y = np.bincount(line_labels, weights=center_y) / np.bincount(line_labels)
+    line_order = np.argsort(lines_y, kind='stable')
+    merged_labels = np.empty(line_count, dtype=np.int64)
+    merged_labels[line_order] = np.cumsum(np.concatenate(([0], np.diff(lines_y[line_order]) > tolerance * avg_height)))
+    polygon_labels = merged_labels[line_labels]
+    # every traced line already goes right to left, so one sort by (line, x rank) gives the reading order
+    sorted_polygons = np.lexsort((-rank_x, polygon_labels))
+    return np.split(sorted_polygons, np.flatnonzero(np.diff(polygon_labels[sorted_polygons])) + 1)
@@ -0,0 +1,258 @@
+import numpy as np
+
+
+POWERS_OF_TEN = 10.0 ** np.arange(23)
+# 10^e for e from -DECADE_OFFSET, only compared with values, so negative powers need not be exact
+DECADE_OFFSET = 24
+DECADES = 10.0 ** np.arange(-DECADE_OFFSET, DECADE_OFFSET)
+
+
+def as_decimal(values):
+    """
+    Float64 values of the shortest decimal representation of float32 values (the same as
+    values.astype(str).astype(np.float64), which is about 40 times slower).
+    Geometry derived from vertices (bbox edges) must be computed from these values,
+    otherwise ties between polygons in the source data are broken by float32 rounding.
+    """
+    values = np.asarray(values, dtype=np.float32)
+    shape = values.shape
+    values = values.ravel()
+    with np.errstate(divide='ignore', invalid='ignore', over='ignore'):
+        exact = values.astype(np.float64)
+        magnitude = np.abs(exact)
+        # zeros, tiny, huge and non-finite values are converted through strings
+        regular = (magnitude >= 1e-13) & (magnitude < 1e13)
+        exponent = np.floor(np.log10(np.where(regular, magnitude, 1.0))).astype(np.int64)
+        # log10 may be off by one next to powers of ten
+        exponent[magnitude >= DECADES[exponent + 1 + DECADE_OFFSET]] += 1
+        exponent[magnitude < DECADES[exponent + DECADE_OFFSET]] -= 1
+        # coordinates have at most 7 significant digits, the nearest 7 digit decimal is the shortest one
+        # when it is the only 7 digit decimal rounding to the value, i.e. float32 spacing is smaller than decimal spacing
+        decimals = nearest_decimals(exact, exponent, 7)
+        unique = np.spacing(np.abs(values)) < DECADES[exponent - 6 + DECADE_OFFSET]
+        found = regular & unique & (decimals.astype(np.float32) == values)
+    rest = np.flatnonzero(regular & ~found)
+    if len(rest):
+        decimals[rest] = shortest_decimals(values[rest], exact[rest], exponent[rest])
+    irregular = np.flatnonzero(~regular)
+    decimals[irregular] = values[irregular].astype(str).astype(np.float64)
+    return decimals.reshape(shape)
+
+
+def nearest_decimals(exact, exponent, digits):
+    """
+    Float64 values of the decimals with the given number of significant digits nearest to the values.
+    """
+    places = digits - 1 - exponent
+    # m / 10^p and m * 10^p of a whole number m are the float64 values nearest to the decimal
+    scale = POWERS_OF_TEN[np.maximum(places, 0)]
+    decimals = np.round(exact * scale) / scale
+    whole = places < 0
+    if whole.any():
+        scale = POWERS_OF_TEN[-places[whole]]
+        decimals[whole] = np.round(exact[whole] / scale) * scale
+    return decimals
+
+
+def shortest_decimals(values, exact, exponent):
+    """
+    Binary search of the fewest significant digits whose nearest decimal rounds back to the float32 value.
+    """
+    lowest = np.ones(len(values), dtype=np.int64)
+    highest = np.full(len(values), 9, dtype=np.int64)
+    searching = np.flatnonzero(lowest < highest)
+    while len(searching):
+        middle = (lowest[searching] + highest[searching]) // 2
+        found = nearest_decimals(exact[searching], exponent[searching], middle).astype(np.float32) == values[searching]
+        highest[searching[found]] = middle[found]
+        lowest[searching[~found]] = middle[~found] + 1
+        searching = searching[lowest[searching] < highest[searching]]
+    return nearest_decimals(exact, exponent, lowest)
+
+
+def round_decimals(values, decimals):
+    """
+    Values rounded the same way as round(value, decimals) does for every value, but vectorized.
+    np.round rounds the scaled value, whose rounding error changes the result only next to a tie,
+    the few values next to a tie are rounded one by one.
+    """
+    rounded = np.round(values, decimals)
+    scaled = values * 10.0 ** decimals
+    near_tie = np.abs(scaled - np.floor(scaled) - 0.5) < 1e-6
+    rounded[near_tie] = [round(value, decimals) for value in values[near_tie].tolist()]
+    return rounded
+
+
+class PolygonStore:
+    """
+    Compact container for all polygons of one page.
+    Vertices of every polygon are kept in one flat float32 buffer of (x, y) pairs,
+    offsets[i] is the index of the first vertex of polygon i and offsets[-1] is the
+    total vertex count, class_ids[i] is the class index of polygon i.
+    """
+
+    def __init__(self, vertices, offsets, class_ids, geometry=None):
+        self.vertices = np.ascontiguousarray(vertices, dtype=np.float32).reshape(-1, 2)
+        self.offsets = np.ascontiguousarray(offsets, dtype=np.int64)
+        self.class_ids = np.ascontiguousarray(class_ids, dtype=np.int32)
+        self._geometry = geometry
+
+    @classmethod
+    def from_counts(cls, coordinates, vertex_counts, class_ids):
+        """
+        Build the store from a flat sequence of coordinates (x1 y1 x2 y2 ...) of all polygons.
+        :param coordinates: Flat sequence of coordinates of all polygons.
+        :param vertex_counts: Number of vertices of each polygon.
+        :param class_ids: Class index of each polygon.
+        :return: PolygonStore.
+        """
+        offsets = np.zeros(len(vertex_counts) + 1, dtype=np.int64)
+        np.cumsum(vertex_counts, out=offsets[1:])
+        # parse as double first so the float32 value is the one nearest to the written decimal
+        vertices = np.asarray(coordinates, dtype=np.float64).astype(np.float32)
+        return cls(vertices, offsets, class_ids)
+
+    @classmethod
+    def concatenate(cls, stores):
+        """
+        One store with polygons of all stores in their order.
+        """
+        counts = np.concatenate([store.vertex_counts for store in stores])
+        offsets = np.zeros(len(counts) + 1, dtype=np.int64)
+        np.cumsum(counts, out=offsets[1:])
+        return cls(np.concatenate([store.vertices for store in stores]), offsets,
+                   np.concatenate([store.class_ids for store in stores]))
+
+    @classmethod
+    def from_yolo_lines(cls, lines):
+        # YOLO instance segmentation format: class_id x1 y1 x2 y2 x3 y3 ...
+        coordinates = []
+        vertex_counts = []
+        class_ids = []
+        for line in lines:
+            parts = line.split()
+            if not parts:
+                continue
+            class_ids.append(int(parts[0]))
+            count = (len(parts) - 1) // 2
+            vertex_counts.append(count)
+            # a dangling coordinate of a truncated line must not shift vertices of the following polygons
+            coordinates.extend(parts[1:1 + 2 * count])
+        return cls.from_counts(coordinates, vertex_counts, class_ids)
+
+    @classmethod
+    def from_yolo_file(cls, filename):
+        with open(filename, 'r') as file:
+            return cls.from_yolo_lines(file)
+
+    @classmethod
+    def from_roboflow_json(cls, json_data):
+        predictions = json_data["predictions"]
+        coordinates = [value for prediction in predictions
+                       for point in prediction["points"] for value in (point["x"], point["y"])]
+        vertex_counts = [len(prediction["points"]) for prediction in predictions]
+        class_ids = [prediction["class_id"] for prediction in predictions]
+        return cls.from_counts(coordinates, vertex_counts, class_ids)
+
+    def __len__(self):
+        return len(self.class_ids)
+
+    @property
+    def vertex_counts(self):
+        return np.diff(self.offsets)
+
+    def polygon(self, index):
+        """
+        Vertices of one polygon as (n, 2) view into the vertex buffer.
+        """
+        return self.vertices[self.offsets[index]:self.offsets[index + 1]]
+
+    def bboxes(self):
+        """
+        Bounding boxes of all polygons in one pass over the vertex buffer.
+        :return: Array of shape (n, 4) with left, top, right, bottom of each polygon.
+        """
+        starts = self.offsets[:-1]
+        mins = np.minimum.reduceat(self.vertices, starts, axis=0)
+        maxs = np.maximum.reduceat(self.vertices, starts, axis=0)
+        return as_decimal(np.hstack((mins, maxs)))
+
+    def geometry(self):
+        """
+        Bounding boxes, centers and sizes of all polygons, computed once per store.
+        """
+        if self._geometry is None:
+            self._geometry = PolygonGeometry(self.bboxes())
+        return self._geometry
+
+    def take(self, order):
+        """
+        New store with polygons in the given order.
+        :param order: Indices of polygons in the new order.
+        :return: PolygonStore.
+        """
+        order = np.asarray(order, dtype=np.int64)
+        counts = self.vertex_counts[order]
+        offsets = np.zeros(len(order) + 1, dtype=np.int64)
+        np.cumsum(counts, out=offsets[1:])
+        # index of every vertex of the reordered polygons in the old buffer
+        vertex_index = np.arange(offsets[-1]) - np.repeat(offsets[:-1], counts) + np.repeat(self.offsets[order], counts)
+        geometry = self._geometry.take(order) if self._geometry is not None else None
+        return PolygonStore(self.vertices[vertex_index], offsets, self.class_ids[order], geometry)
+
+    def coordinate_strings(self):
+        """
+        Coordinates as shortest decimal strings.
+        All coordinates in YOLO and Roboflow exports have at most 7 significant digits,
+        so they are written back exactly as they were read.
+        """
+        return self.vertices.ravel().astype(str)
+
+    def decimal_vertices(self):
+        return as_decimal(self.vertices)
+
+    def to_relative(self, image_size):
+        """
+        Polygons in pixels converted to relative coordinates of YOLO format with 6 decimals,
+        the same way as convert_to_relative_coordinates in json_to_yolo.py does.
+        :param image_size: Size (width, height) of the image.
+        """
+        relative = round_decimals(self.decimal_vertices() / np.asarray(image_size, dtype=np.float64), 6)
+        return PolygonStore(relative, self.offsets, self.class_ids)
+
+    def to_yolo_lines(self):
+        coordinates = self.coordinate_strings()
+        starts = self.offsets * 2
+        for index, class_index in enumerate(self.class_ids.tolist()):
+            yield f"{class_index} {' '.join(coordinates[starts[index]:starts[index + 1]])}\n"
+
+    def to_roboflow_json(self):
+        decimal_vertices = self.decimal_vertices()
+        # Roboflow writes whole pixel coordinates as integers
+        integral = decimal_vertices == np.floor(decimal_vertices)
+        vertices = decimal_vertices.astype(object)
+        vertices[integral] = decimal_vertices[integral].astype(np.int64).tolist()
+        vertices = vertices.tolist()
+        offsets = self.offsets.tolist()
+        predictions = []
+        for index, class_index in enumerate(self.class_ids.tolist()):
+            points = [{"x": x, "y": y} for x, y in vertices[offsets[index]:offsets[index + 1]]]
+            predictions.append({"class_id": class_index, "points": points})
+        return {"predictions": predictions}
+
+
+class PolygonGeometry:
+    """
+    Bounding boxes, centers, widths and heights of all polygons of a page as arrays.
+    """
+
+    def __init__(self, bboxes):
+        self.bboxes = bboxes
+        self.left, self.top, self.right, self.bottom = bboxes.T
+        self.center_x = (self.left + self.right) / 2
+        self.center_y = (self.top + self.bottom) / 2
+        self.width = self.right - self.left
+        self.height = self.bottom - self.top
+
+    def take(self, order):
+        return PolygonGeometry(self.bboxes[order])
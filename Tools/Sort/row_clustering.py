@@ -0,0 +1,113 @@
+import numpy as np
+from line_tracing import trace_lines
+
+# Upper bound of histogram bins of the density strategy, keeps pages with outliers in O(n log n)
+MAX_DENSITY_BINS = 1 << 16
+
+
+def threshold_row_starts(center_y, avg_height, threshold_ratio=0.5):
+    """
+    New row starts where center y jumps more than threshold from the previous polygon.
+    :param center_y: Polygon centers y sorted top to bottom.
+    :param avg_height: Average polygon height.
+    :param threshold_ratio: Threshold as a fraction of average polygon height.
+    :return: Positions in center_y where a new row starts.
+    """
+    return np.flatnonzero(np.diff(center_y) > avg_height * threshold_ratio) + 1
+
+
+def gap_histogram_row_starts(center_y, avg_height, bins=64, min_ratio=0.25):
+    """
+    Same as threshold, but the threshold is picked from the histogram of gaps between
+    neighbouring centers (Otsu split between in-row gaps and gaps between rows).
+    The threshold never drops below min_ratio of average polygon height,
+    so single row pages are not split by glyph height variation.
+    """
+    gaps = np.diff(center_y)
+    if len(gaps) < 2:
+        return threshold_row_starts(center_y, avg_height)
+    counts, edges = np.histogram(gaps, bins=bins)
+    middles = (edges[:-1] + edges[1:]) / 2
+    weight_low = np.cumsum(counts)[:-1]
+    weight_high = len(gaps) - weight_low
+    moment_low = np.cumsum(counts * middles)[:-1]
+    moment_high = np.sum(counts * middles) - moment_low
+    with np.errstate(divide='ignore', invalid='ignore'):
+        between_variance = weight_low * weight_high * (moment_low / weight_low - moment_high / weight_high) ** 2
+    between_variance[(weight_low == 0) | (weight_high == 0)] = -1
+    threshold = max(edges[np.argmax(between_variance) + 1], avg_height * min_ratio)
+    return np.flatnonzero(gaps > threshold) + 1
+
+
+def density_row_starts(center_y, avg_height, bandwidth_ratio=0.25, valley_ratio=0.5):
+    """
+    Rows are modes of 1-D kernel density of centers y.
+    A row ends in a density valley, which is lower than valley_ratio of both neighbouring peaks.
+    :param bandwidth_ratio: Gaussian kernel sigma as a fraction of average polygon height.
+    """
+    if len(center_y) < 2 or avg_height <= 0:
+        return np.zeros(0, dtype=np.int64)
+    sigma_bins = 2
+    low = center_y[0]
+    bin_width = max(avg_height * bandwidth_ratio / sigma_bins, (center_y[-1] - low) / MAX_DENSITY_BINS)
+    bins = np.minimum(((center_y - low) / bin_width).astype(np.int64), MAX_DENSITY_BINS - 1)
+    counts = np.bincount(bins).astype(np.float64)
+    kernel_x = np.arange(-3 * sigma_bins, 3 * sigma_bins + 1)
+    kernel = np.exp(-0.5 * (kernel_x / sigma_bins) ** 2)
+    density = np.convolve(counts, kernel, mode='same')
+
+    # local maxima, plateaus are represented by their first bin
+    padded = np.concatenate(([-1.0], density, [-1.0]))
+    peaks = np.flatnonzero((padded[1:-1] > padded[:-2]) & (padded[1:-1] >= padded[2:]))
+    splits = []
+    peak_height = density[peaks[0]]
+    for left, right in zip(peaks[:-1], peaks[1:]):
+        valley = left + np.argmin(density[left:right + 1])
+        if density[valley] <= valley_ratio * min(peak_height, density[right]):
+            splits.append(valley)
+            peak_height = density[right]
+        else:
+            peak_height = max(peak_height, density[right])
+    # centers in the valley bin belong to the row below
+    row_starts = np.unique(np.searchsorted(bins, splits, side='left'))
+    return row_starts[(row_starts > 0) & (row_starts < len(center_y))]
+
+
+ROW_STRATEGIES = {
+    'threshold': threshold_row_starts,
+    'gap': gap_histogram_row_starts,
+    'density': density_row_starts,
+}
+
+# row clustering strategies and the neighbour line tracer for skewed and curved lines
+SORT_STRATEGIES = list(ROW_STRATEGIES) + ['lines']
+
+
+def cluster_rows(polygons, strategy='threshold', sort_last_row=None):
+    """
+    Sort all polygons in list of rows.
+    Lines are sorted from right to left.
+    :param polygons: PolygonStore with all unsorted polygons.
+    :param strategy: Name of row clustering strategy from ROW_STRATEGIES or 'lines' for line tracing.
+    :param sort_last_row: Sort also the last row right to left. Threshold strategy keeps
+        the last row top to bottom by default, its output is the one in the reference *-sorted files.
+    :return: List of rows with indices of sorted polygons.
+    """
+    if strategy == 'lines':
+        return trace_lines(polygons)
+    if sort_last_row is None:
+        sort_last_row = strategy != 'threshold'
+    geometry = polygons.geometry()
+    avg_height = np.average(geometry.height)
+    first_sorted_polygons = np.argsort(geometry.center_y, kind='stable')
+    row_starts = ROW_STRATEGIES[strategy](geometry.center_y[first_sorted_polygons], avg_height)
+
+    # one stable sort by (row, right to left) instead of sorting every row on its own
+    row_labels = np.zeros(len(first_sorted_polygons), dtype=np.int64)
+    row_labels[row_starts] = 1
+    row_labels = np.cumsum(row_labels)
+    x_key = -geometry.center_x[first_sorted_polygons]
+    if not sort_last_row:
+        x_key[row_starts[-1] if len(row_starts) else 0:] = 0
+    sorted_polygons = first_sorted_polygons[np.lexsort((x_key, row_labels))]
+    return np.split(sorted_polygons, row_starts)
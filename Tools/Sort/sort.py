@@ -1,7 +1,13 @@
-import matplotlib.pyplot as plt
 import numpy as np
 import argparse
 import os
+import sys
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'Common'))
+from profiling import add_profile_arguments, create_profiler
+from polygon_store import PolygonStore
+from row_clustering import SORT_STRATEGIES, cluster_rows
+from batch_sort import find_input_files, run_batch
+from visualize import generate_figure_filename, visualize_sorted_polygons
 
 
 def read_class_names_from_file(filename):
@@ -19,178 +25,94 @@ def read_class_names_from_file(filename):
 
 
 def read_polygons_from_file(filename):
-    with open(filename, 'r') as file:
-        lines = file.readlines()
+    return PolygonStore.from_yolo_file(filename)
 
-    polygons = []
-    for line in lines:
-        parts = line.strip().split(' ')
-        class_index = int(parts[0])
-        coordinates = [float(coord) for coord in parts[1:]]
-        polygons.append({'class_index': class_index, 'coordinates': coordinates})
-
-    return polygons
-
-def get_avg_polygons_size(polygons):
-    polygons_heights = []
-    polygons_widths = []
-    for polygon in polygons:
-        x_coords = [polygon['coordinates'][i] for i in range(0, len(polygon['coordinates']), 2)]
-        y_coords = [polygon['coordinates'][i] for i in range(1, len(polygon['coordinates']), 2)]
-        left, right, top, bottom = min(x_coords), max(x_coords), min(y_coords), max(y_coords)
-        polygons_heights.append(bottom - top)
-        polygons_widths.append(right - left)
-    
-    polygons_avg_height = np.average(polygons_heights)
-    polygons_avg_width = np.average(polygons_widths)
-    return (polygons_avg_height, polygons_avg_width)
-
-def get_polygon_center(polygon):
-    x_coords = [polygon['coordinates'][i] for i in range(0, len(polygon['coordinates']), 2)]
-    y_coords = [polygon['coordinates'][i] for i in range(1, len(polygon['coordinates']), 2)]
-    left, right, top, bottom = min(x_coords), max(x_coords), min(y_coords), max(y_coords)
-    x_center = (left + right) / 2
-    y_center = (top + bottom) / 2
-    return (x_center, y_center)
-
-def get_polygon_center_x(polygon):
-    return get_polygon_center(polygon)[0]
-
-def get_polygon_center_y(polygon):
-    return get_polygon_center(polygon)[1]
-
-def sort_polygons(polygons):
+def sort_polygons(polygons, strategy='threshold'):
     """
     Sort list of all polygons in one list without reflecting rows.
     Lines are sorted from right to left.
-    :param polygons: List of all unsorted polygons.
-    :return: List of sorted polygons.
+    :param polygons: PolygonStore with all unsorted polygons.
+    :param strategy: Name of row clustering strategy (see row_clustering.SORT_STRATEGIES).
+    :return: PolygonStore with sorted polygons.
     """
-    sorted_polygons = []
-    polygons_in_rows = sort_polygons_in_rows(polygons)
-    for row in polygons_in_rows:
-        sorted_polygons = sorted_polygons + row
-    return sorted_polygons
+    polygons_in_rows = sort_polygons_in_rows(polygons, strategy)
+    return polygons.take(np.concatenate(polygons_in_rows))
 
 #output is 
-def sort_polygons_in_rows(polygons):
+def sort_polygons_in_rows(polygons, strategy='threshold'):
     """
     Sort all polygons in list of rows.
     Lines are sorted from right to left.
-    :param polygons: List of all unsorted polygons.
-    :return: List of rows with sorted polygons.
+    :param polygons: PolygonStore with all unsorted polygons.
+    :param strategy: Name of row clustering strategy (see row_clustering.SORT_STRATEGIES).
+    :return: List of rows with indices of sorted polygons.
     """
-    rows = []
-    avg_height, avg_width = get_avg_polygons_size(polygons)
-    threshold_height = avg_height / 2
-    first_sorted_polygons = sorted(polygons, key=get_polygon_center_y)
-    row_count = 0
-    last_polygon = first_sorted_polygons[0]
-    rows.append([])
-    for polygon in first_sorted_polygons:
-        compare_value = abs(get_polygon_center_y(polygon) - get_polygon_center_y(last_polygon))
-        if compare_value > threshold_height:
-            #first sort row which is done by polygons center (right to left)
-            rows[row_count] = sorted(rows[row_count], key=get_polygon_center_x, reverse=True)
-            row_count = row_count + 1
-            rows.append([])
-        rows[row_count].append(polygon)
-        last_polygon = polygon
-    return rows
+    return cluster_rows(polygons, strategy)
 
 def save_sorted_polygons_to_file(sorted_polygons, output_filename):
     with open(output_filename, 'w') as file:
-        for polygon in sorted_polygons:
-            class_index = polygon['class_index']
-            coordinates = ' '.join(map(str, polygon['coordinates']))
-            file.write(f"{class_index} {coordinates}\n")
-
-def visualize_sorted_polygons(sorted_polygons, class_names):
-    # Create a colormap for unique colors for each class
-    colormap = plt.cm.get_cmap('tab10', len(set(polygon['class_index'] for polygon in sorted_polygons)))
-
-    # Set the figure size
-    plt.figure(figsize=(6, 12))  # Adjust the values as needed (width, height)
-
-    # Plot the sorted polygons
-    for polygon in sorted_polygons:
-        x_coords = [polygon['coordinates'][i] for i in range(0, len(polygon['coordinates']), 2)]
-        y_coords = [polygon['coordinates'][i] for i in range(1, len(polygon['coordinates']), 2)]
-
-        class_color = colormap(polygon['class_index'] % colormap.N)
-        plt.fill(x_coords + [x_coords[0]], y_coords + [y_coords[0]], color=class_color, label=None)
-
-        # Label each polygon with its class name above the polygon in 8 px font
-        label_x = sum(x_coords) / len(x_coords)
-        label_y = max(y_coords) + 0.02  # Adjust the label position as needed
-        plt.text(label_x, label_y, f"{class_names[polygon['class_index']]}",
-                 color='black', fontsize=8, ha='center', va='center')
-
-    plt.xlabel('X-coordinate')
-    plt.ylabel('Y-coordinate')
-    plt.title('Sorted Polygons')
-    plt.gca().invert_yaxis()  # Invert the Y-axis
-    plt.savefig('Fig1.png', bbox_inches='tight')
-
-
-def main(input_filename, output_filename, class_list_filename):
-    class_names = read_class_names_from_file(class_list_filename)
-
-    polygons = read_polygons_from_file(input_filename)
-
-    print("Sorting polygons in rows...")
-    sorted_polygons_rows = sort_polygons_in_rows(polygons)
-    # Printing out list of sorted polygons with rows
-    for index, row in enumerate(sorted_polygons_rows):
-        print("Row ", index)
-        for polygon in row:
-            print("Polygon: ", polygon['class_index'], " - ", class_names[polygon['class_index']])
-    
-    print("Sorting polygons (no rows)...")
-    sorted_polygons = sort_polygons(polygons)
-    # Printing out list of sorted polygons without rows involved
-    for polygon in sorted_polygons:
-        print("Polygon: ", polygon['class_index'], " - ", class_names[polygon['class_index']])
-
-
-    # Visualize and save the sorted polygons
-    print("Saving visualization of polygons and sorted list to file...")
-    visualize_sorted_polygons(polygons, class_names)
-    print('Figure saved.')
-    save_sorted_polygons_to_file(sorted_polygons, output_filename) #řadí divně, řádky bere dobře, ale v rámci řádku to má blbě   
-    print('Sorted polygons saved to ', output_filename)
-
-    print("DONE")
+        file.writelines(sorted_polygons.to_yolo_lines())
 
 def generate_output_filename(input_filename):
     base_filename, ext = os.path.splitext(os.path.basename(input_filename))
     return f"{base_filename}_output.txt"
 
+def sort_file(input_filename, strategy='threshold'):
+    """
+    Sort one file and save sorted polygons next to it (batch mode).
+    :return: Output filename, PolygonStore with sorted polygons and number of rows.
+    """
+    polygons = read_polygons_from_file(input_filename)
+    rows = sort_polygons_in_rows(polygons, strategy)
+    sorted_polygons = polygons.take(np.concatenate(rows))
+    output_filename = os.path.join(os.path.dirname(input_filename), generate_output_filename(input_filename))
+    save_sorted_polygons_to_file(sorted_polygons, output_filename)
+    return output_filename, sorted_polygons, len(rows)
+
 def main(args):
+    with create_profiler(args, 'sort') as profiler:
+        sort_with_profiler(args, profiler)
+
+def sort_with_profiler(args, profiler):
+    if args.batch:
+        input_filenames = find_input_files(args.batch, "*.txt", "_output.txt")
+        with profiler.stage('batch', files=len(input_filenames)):
+            run_batch(input_filenames, sort_file, read_class_names_from_file, args.classes, args.strategy, args.workers,
+                      not args.no_plot)
+        return
+
     input_filename = args.input
     output_filename = args.output if args.output else generate_output_filename(input_filename)
-    class_list_file = "class_list.txt"
+    class_list_file = args.classes
 
-    class_names = read_class_names_from_file(class_list_file)
-    polygons = read_polygons_from_file(input_filename)
+    with profiler.stage('read') as counts:
+        class_names = read_class_names_from_file(class_list_file)
+        polygons = read_polygons_from_file(input_filename)
+        counts.update(polygons=len(polygons), vertices=len(polygons.vertices))
 
     print("Sorting polygons in rows...")
-    sorted_polygons_rows = sort_polygons_in_rows(polygons)
+    with profiler.stage('sort', polygons=len(polygons)) as counts:
+        sorted_polygons_rows = sort_polygons_in_rows(polygons, args.strategy)
+        # the same order as sort_polygons, rows are not clustered again
+        sorted_polygons = polygons.take(np.concatenate(sorted_polygons_rows))
+        counts["rows"] = len(sorted_polygons_rows)
     for index, row in enumerate(sorted_polygons_rows):
         print("Row ", index)
-        for polygon in row:
-            print("Polygon: ", polygon['class_index'], " - ", class_names[polygon['class_index']])
+        for class_index in polygons.class_ids[row].tolist():
+            print("Polygon: ", class_index, " - ", class_names[class_index])
 
     print("Sorting polygons (no rows)...")
-    sorted_polygons = sort_polygons(polygons)
-    for polygon in sorted_polygons:
-        #print("Polygon: ", polygon['class_index'], " - ", class_names[polygon['class_index']])
-        print(class_names[polygon['class_index']])
-
-    print("Saving visualization of polygons and sorted list to file...")
-    visualize_sorted_polygons(polygons, class_names)
-    print('Figure saved.')
-    save_sorted_polygons_to_file(sorted_polygons, output_filename)
+    for class_index in sorted_polygons.class_ids.tolist():
+        #print("Polygon: ", class_index, " - ", class_names[class_index])
+        print(class_names[class_index])
+
+    if not args.no_plot:
+        print("Saving visualization of polygons and sorted list to file...")
+        with profiler.stage('plot', polygons=len(polygons)):
+            figure_filename = visualize_sorted_polygons(polygons, class_names, args.figure or generate_figure_filename(output_filename))
+        print(f'Figure saved to {figure_filename}')
+    with profiler.stage('save', polygons=len(sorted_polygons)):
+        save_sorted_polygons_to_file(sorted_polygons, output_filename)
     print(f'Sorted polygons saved to {output_filename}')
 
     print("DONE")
@@ -198,7 +120,15 @@ def main(args):
 if __name__ == "__main__":
     parser = argparse.ArgumentParser(description="Sort and visualize polygons.")
     parser.add_argument("-i", "--input", help="Input filename")
+    parser.add_argument("-s", "--strategy", choices=SORT_STRATEGIES, default="threshold",
+                        help="Row clustering strategy, lines traces skewed and curved lines")
     parser.add_argument("-o", "--output", help="Output filename")
+    parser.add_argument("-f", "--figure", help="Figure filename (default derived from output filename)")
+    parser.add_argument("--no-plot", action="store_true", help="Do not visualize polygons, matplotlib is not imported")
+    parser.add_argument("-c", "--classes", default="class_list.txt", help="Class list filename")
+    parser.add_argument("-b", "--batch", help="Directory or glob of input files to sort, outputs are saved next to inputs")
+    parser.add_argument("-w", "--workers", type=int, help="Number of worker processes in batch mode (default number of CPUs)")
+    add_profile_arguments(parser)
 
     args = parser.parse_args()
     main(args)
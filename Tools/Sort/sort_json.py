@@ -1,8 +1,14 @@
-import matplotlib.pyplot as plt
 import numpy as np
 import argparse
 import os
 import json
+import sys
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'Common'))
+from profiling import add_profile_arguments, create_profiler
+from polygon_store import PolygonStore
+from row_clustering import SORT_STRATEGIES, cluster_rows
+from batch_sort import find_input_files, run_batch
+from visualize import generate_figure_filename, visualize_sorted_polygons
 
 def read_class_names_from_file(filename):
     with open(filename, 'r') as file:
@@ -18,130 +24,94 @@ def read_class_names_from_file(filename):
     return class_names
 
 def read_polygons_from_json(json_data):
-    predictions = json_data["predictions"]
-    polygons = []
-    for prediction in predictions:
-        class_index = prediction["class_id"]
-        coordinates = [(point["x"], point["y"]) for point in prediction["points"]]
-        polygons.append({'class_index': class_index, 'coordinates': coordinates})
-
-    return polygons
-
-def get_avg_polygons_size(polygons):
-    polygons_heights = []
-    polygons_widths = []
-    for polygon in polygons:
-        x_coords = [point[0] for point in polygon['coordinates']]
-        y_coords = [point[1] for point in polygon['coordinates']]
-        left, right, top, bottom = min(x_coords), max(x_coords), min(y_coords), max(y_coords)
-        polygons_heights.append(bottom - top)
-        polygons_widths.append(right - left)
-    
-    polygons_avg_height = np.average(polygons_heights)
-    polygons_avg_width = np.average(polygons_widths)
-    return (polygons_avg_height, polygons_avg_width)
-
-def get_polygon_center(polygon):
-    x_coords = [point[0] for point in polygon['coordinates']]
-    y_coords = [point[1] for point in polygon['coordinates']]
-    left, right, top, bottom = min(x_coords), max(x_coords), min(y_coords), max(y_coords)
-    x_center = (left + right) / 2
-    y_center = (top + bottom) / 2
-    return (x_center, y_center)
-
-def get_polygon_center_x(polygon):
-    return get_polygon_center(polygon)[0]
-
-def get_polygon_center_y(polygon):
-    return get_polygon_center(polygon)[1]
-
-def sort_polygons(polygons):
-    sorted_polygons = []
-    polygons_in_rows = sort_polygons_in_rows(polygons)
-    for row in polygons_in_rows:
-        sorted_polygons = sorted_polygons + row
-    return sorted_polygons
-
-def sort_polygons_in_rows(polygons):
-    rows = []
-    avg_height, avg_width = get_avg_polygons_size(polygons)
-    threshold_height = avg_height / 2
-    first_sorted_polygons = sorted(polygons, key=get_polygon_center_y)
-    row_count = 0
-    last_polygon = first_sorted_polygons[0]
-    rows.append([])
-    for polygon in first_sorted_polygons:
-        compare_value = abs(get_polygon_center_y(polygon) - get_polygon_center_y(last_polygon))
-        if compare_value > threshold_height:
-            rows[row_count] = sorted(rows[row_count], key=get_polygon_center_x, reverse=True)
-            row_count = row_count + 1
-            rows.append([])
-        rows[row_count].append(polygon)
-        last_polygon = polygon
-    return rows
-
-def visualize_sorted_polygons(sorted_polygons, class_names):
-    colormap = plt.cm.get_cmap('tab10', len(set(polygon['class_index'] for polygon in sorted_polygons)))
-    plt.figure(figsize=(6, 12))
-    for polygon in sorted_polygons:
-        x_coords = [point[0] for point in polygon['coordinates']]
-        y_coords = [point[1] for point in polygon['coordinates']]
-        class_color = colormap(polygon['class_index'] % colormap.N)
-        plt.fill(x_coords + [x_coords[0]], y_coords + [y_coords[0]], color=class_color, label=None)
-        label_x = sum(x_coords) / len(x_coords)
-        label_y = max(y_coords) + 0.02
-        plt.text(label_x, label_y, f"{class_names[polygon['class_index']]}",
-                 color='black', fontsize=8, ha='center', va='center')
-    plt.xlabel('X-coordinate')
-    plt.ylabel('Y-coordinate')
-    plt.title('Sorted Polygons')
-    plt.gca().invert_yaxis()
-    plt.savefig('Fig1.png', bbox_inches='tight')
+    return PolygonStore.from_roboflow_json(json_data)
+
+def sort_polygons(polygons, strategy='threshold'):
+    polygons_in_rows = sort_polygons_in_rows(polygons, strategy)
+    return polygons.take(np.concatenate(polygons_in_rows))
+
+def sort_polygons_in_rows(polygons, strategy='threshold'):
+    return cluster_rows(polygons, strategy)
 
 def save_sorted_polygons_to_json(sorted_polygons, input_filename, class_names):
     output_filename = os.path.splitext(input_filename)[0] + "-sorted.json"
-    output_data = {"predictions": []}
-    for polygon in sorted_polygons:
-        class_index = polygon['class_index']
-        coordinates = [{"x": point[0], "y": point[1]} for point in polygon['coordinates']]
-        output_data["predictions"].append({"class_id": class_index, "points": coordinates})
+    output_data = sorted_polygons.to_roboflow_json()
 
     with open(output_filename, 'w') as json_file:
         json.dump(output_data, json_file, indent=4)
 
     return output_filename
 
+def sort_file(input_filename, strategy='threshold'):
+    """
+    Sort one file and save sorted polygons next to it (batch mode).
+    :return: Output filename, PolygonStore with sorted polygons and number of rows.
+    """
+    with open(input_filename, 'r') as json_file:
+        polygons = read_polygons_from_json(json.load(json_file))
+    rows = sort_polygons_in_rows(polygons, strategy)
+    sorted_polygons = polygons.take(np.concatenate(rows))
+    output_filename = save_sorted_polygons_to_json(sorted_polygons, input_filename, None)
+    return output_filename, sorted_polygons, len(rows)
+
 def main(args):
+    with create_profiler(args, 'sort_json') as profiler:
+        sort_with_profiler(args, profiler)
+
+def sort_with_profiler(args, profiler):
+    if args.batch:
+        input_filenames = find_input_files(args.batch, "*.json", "-sorted.json")
+        with profiler.stage('batch', files=len(input_filenames)):
+            run_batch(input_filenames, sort_file, read_class_names_from_file, args.classes, args.strategy, args.workers,
+                      not args.no_plot)
+        return
+
     input_filename = args.input
-    class_list_file = "class_list.txt"
+    class_list_file = args.classes
 
-    class_names = read_class_names_from_file(class_list_file)
+    with profiler.stage('read') as counts:
+        class_names = read_class_names_from_file(class_list_file)
 
-    with open(input_filename, 'r') as json_file:
-        json_data = json.load(json_file)
+        with open(input_filename, 'r') as json_file:
+            json_data = json.load(json_file)
 
-    polygons = read_polygons_from_json(json_data)
+        polygons = read_polygons_from_json(json_data)
+        counts.update(polygons=len(polygons), vertices=len(polygons.vertices))
 
-    sorted_polygons_rows = sort_polygons_in_rows(polygons)
+    with profiler.stage('sort', polygons=len(polygons)) as counts:
+        sorted_polygons_rows = sort_polygons_in_rows(polygons, args.strategy)
+        # the same order as sort_polygons, rows are not clustered again
+        sorted_polygons = polygons.take(np.concatenate(sorted_polygons_rows))
+        counts["rows"] = len(sorted_polygons_rows)
     for index, row in enumerate(sorted_polygons_rows):
         print("Row ", index)
-        for polygon in row:
-            print("Polygon: ", polygon['class_index'], " - ", class_names[polygon['class_index']])
+        for class_index in polygons.class_ids[row].tolist():
+            print("Polygon: ", class_index, " - ", class_names[class_index])
 
-    sorted_polygons = sort_polygons(polygons)
-    for polygon in sorted_polygons:
-        print(class_names[polygon['class_index']])
+    for class_index in sorted_polygons.class_ids.tolist():
+        print(class_names[class_index])
 
-    visualize_sorted_polygons(polygons, class_names)
-    print('Figure saved.')
-
-    output_filename = save_sorted_polygons_to_json(sorted_polygons, input_filename, class_names)
+    with profiler.stage('save', polygons=len(sorted_polygons)):
+        output_filename = save_sorted_polygons_to_json(sorted_polygons, input_filename, class_names)
     print(f'Sorted polygons saved to: {output_filename}')
 
+    if not args.no_plot:
+        with profiler.stage('plot', polygons=len(polygons)):
+            figure_filename = visualize_sorted_polygons(polygons, class_names, args.figure or generate_figure_filename(output_filename))
+        print(f'Figure saved to: {figure_filename}')
+
     print("DONE")
 
 if __name__ == "__main__":
     parser = argparse.ArgumentParser(description="Sort and visualize polygons.")
     parser.add_argument("-i", "--input", help="Input filename")
+    parser.add_argument("-s", "--strategy", choices=SORT_STRATEGIES, default="threshold",
+                        help="Row clustering strategy, lines traces skewed and curved lines")
+    parser.add_argument("-f", "--figure", help="Figure filename (default derived from output filename)")
+    parser.add_argument("--no-plot", action="store_true", help="Do not visualize polygons, matplotlib is not imported")
+    parser.add_argument("-c", "--classes", default="class_list.txt", help="Class list filename")
+    parser.add_argument("-b", "--batch", help="Directory or glob of input files to sort, outputs are saved next to inputs")
+    parser.add_argument("-w", "--workers", type=int, help="Number of worker processes in batch mode (default number of CPUs)")
+    add_profile_arguments(parser)
     args = parser.parse_args()
     main(args)
@@ -0,0 +1,44 @@
+import os
+
+
+def generate_figure_filename(output_filename):
+    base_filename, ext = os.path.splitext(output_filename)
+    return f"{base_filename}.png"
+
+
+def visualize_sorted_polygons(sorted_polygons, class_names, figure_filename='Fig1.png'):
+    # matplotlib is imported only when a figure is requested, sorting alone never loads it
+    import matplotlib.pyplot as plt
+
+    # Create a colormap for unique colors for each class
+    colormap = plt.cm.get_cmap('tab10', len(set(sorted_polygons.class_ids.tolist())))
+
+    # Set the figure size
+    figure = plt.figure(figsize=(6, 12))  # Adjust the values as needed (width, height)
+    try:
+        axes = figure.gca()
+
+        # Plot the sorted polygons
+        for index, class_index in enumerate(sorted_polygons.class_ids.tolist()):
+            points = sorted_polygons.polygon(index)
+            x_coords = points[:, 0].tolist()
+            y_coords = points[:, 1].tolist()
+
+            class_color = colormap(class_index % colormap.N)
+            axes.fill(x_coords + [x_coords[0]], y_coords + [y_coords[0]], color=class_color, label=None)
+
+            # Label each polygon with its class name above the polygon in 8 px font
+            label_x = sum(x_coords) / len(x_coords)
+            label_y = max(y_coords) + 0.02  # Adjust the label position as needed
+            axes.text(label_x, label_y, f"{class_names[class_index]}",
+                      color='black', fontsize=8, ha='center', va='center')
+
+        axes.set_xlabel('X-coordinate')
+        axes.set_ylabel('Y-coordinate')
+        axes.set_title('Sorted Polygons')
+        axes.invert_yaxis()  # Invert the Y-axis
+        figure.savefig(figure_filename, bbox_inches='tight')
+    finally:
+        # figures are kept by pyplot until closed, batch runs would keep all of them in memory
+        plt.close(figure)
+    return figure_filename